@@ -1,21 +1,183 @@
 import os
+import time
 from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from metrics import Histogram, instrument_engine
+from profiling import PROFILE_ENABLED, profile_engine
 
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Async drivers for the sync drivers DATABASE_URL may name.
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+}
+
+
+def async_database_url(url: str):
+    """The async-driver variant of a database URL, or None if there is none."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        return None
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}")
+
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Cloud SQL drops idle connections; recycle them before that happens.
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+
+class _TimedPoolMixin:
+    """Records how long checkouts wait for a connection."""
+
+    wait_seconds = None
+    timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            type(self).timeouts += 1
+            raise
+        finally:
+            self.wait_seconds.observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    wait_seconds = Histogram()
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    wait_seconds = Histogram()
+
+
+def pool_options(url, is_async: bool = False):
+    """Engine keyword arguments for the configured connection pool."""
+    options = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+        )
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, _TimedPoolMixin):
+        stats.update(
+            timeouts=type(pool).timeouts,
+            wait_seconds=pool.wait_seconds.snapshot(),
+        )
+    return stats
+
+
+def increment_statement(db: Session, table, key_columns, total_columns):
+    """
+    INSERT into table that adds the inserted totals to those of an existing
+    row with the same key instead of failing: ON DUPLICATE KEY UPDATE on
+    MySQL, ON CONFLICT on SQLite. Run it as an executemany.
+    """
+    if db.get_bind().dialect.name == "mysql":
+        statement = mysql.insert(table)
+        return statement.on_duplicate_key_update(
+            {name: table.c[name] + statement.inserted[name] for name in total_columns}
+        )
+    statement = sqlite.insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c[name] for name in key_columns],
+        set_={name: table.c[name] + statement.excluded[name] for name in total_columns},
+    )
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(SQLALCHEMY_DATABASE_URL))
+instrument_engine(engine)
+if PROFILE_ENABLED:
+    profile_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Routes use the async engine unless DB_ASYNC=0; background threads, scripts
+# and the tests keep using the sync engine above.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(
+    SQLALCHEMY_DATABASE_URL
+)
+if os.getenv("DB_ASYNC", "1") == "1" and ASYNC_DATABASE_URL is not None:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, is_async=True)
+    )
+    instrument_engine(async_engine.sync_engine)
+    if PROFILE_ENABLED:
+        profile_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False)
+else:
+    async_engine = None
+    AsyncSessionLocal = None
+
 Base = declarative_base()
 
-def get_db():
+DbSession = Session | AsyncSession
+
+
+async def get_sync_db():
+    """
+    A sync Session for routes whose work is mostly CPU besides its queries:
+    encoding large listings, building snapshots and in-memory indexes,
+    geometry tests, derived-table deltas of bulk writes. run_db runs those in
+    the threadpool, where they do not stall the event loop.
+    """
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        await run_in_threadpool(db.close)
+
+
+async def get_db():
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+    else:
+        async with AsyncSessionLocal() as db:
+            yield db
+
+
+async def run_db(db: DbSession, fn):
+    """
+    Run fn(session), a function written against a sync Session. An
+    AsyncSession runs it through run_sync, so the queries use the async
+    driver; a sync Session runs it in the threadpool.
+
+    run_sync runs fn on the event-loop thread and only its I/O yields to
+    other requests, so routes with CPU-heavy work take a get_sync_db session.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn)
+    return await run_in_threadpool(fn, db)
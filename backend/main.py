@@ -1,16 +1,43 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordBearer
 from database import get_db
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel, SecurityScheme
 from fastapi.middleware.cors import CORSMiddleware
-from routers import user_router, tree_router, token_router
+from fastapi.middleware.gzip import GZipMiddleware
+from compression import GZIP_LEVEL, MIN_COMPRESS_BYTES
+from metrics import RequestMetricsMiddleware
+from profiling import PROFILE_ENABLED, QueryProfilerMiddleware, configure_profile_log
+from routers import (
+    user_router,
+    tree_router,
+    token_router,
+    import_router,
+    internal_router,
+    metrics_router,
+)
 from services import token_service
+from services.import_service import stop_import_workers
+from services.nearest_service import start_nearest_sync, stop_nearest_sync
+from services.revocation_service import start_revocation_sync, stop_revocation_sync
 from fastapi.openapi.utils import get_openapi
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_revocation_sync()
+    start_nearest_sync()
+    yield
+    stop_nearest_sync()
+    stop_revocation_sync()
+    stop_import_workers()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -19,11 +46,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Change-Cursor"],
 )
+# Compresses whatever a route did not compress itself, streams included.
+app.add_middleware(GZipMiddleware, minimum_size=MIN_COMPRESS_BYTES, compresslevel=GZIP_LEVEL)
+app.add_middleware(RequestMetricsMiddleware)
+if PROFILE_ENABLED:
+    configure_profile_log()
+    app.add_middleware(QueryProfilerMiddleware)
 
 app.include_router(user_router, tags=["Users"])
 app.include_router(tree_router, tags=["Trees"])
 app.include_router(token_router, tags=["Tokens"])
+app.include_router(import_router, tags=["Imports"])
+app.include_router(internal_router)
+app.include_router(metrics_router)
 
 
 def custom_openapi():
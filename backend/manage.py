@@ -0,0 +1,140 @@
+import argparse
+import json
+from sqlalchemy import select
+from database import SessionLocal
+from models import Tree, TreeCluster, TreeStatsCell
+from services.cluster_service import rebuild_clusters
+from services.merge_service import (
+    MERGE_BATCH_SIZE,
+    MERGE_METHODS,
+    MERGE_RADIUS_M,
+    merge_duplicates,
+)
+from services.stats_service import rebuild_stats
+from services.tree_service import backfill_grid_cells, iter_tree_points
+
+
+def backfill_grid_cells_command(args):
+    db = SessionLocal()
+    try:
+        updated = backfill_grid_cells(db, only_missing=not args.all)
+        print(f"Updated grid cells for {updated} trees.")
+    finally:
+        db.close()
+
+
+def _is_derived_missing(db, model):
+    # Mutations keep the derived tables filled while there are trees, so an
+    # empty one next to trees was created by a migration and never filled.
+    return (
+        db.execute(select(model).limit(1)).first() is None
+        and db.execute(select(Tree.id).limit(1)).first() is not None
+    )
+
+
+def rebuild_clusters_command(args):
+    db = SessionLocal()
+    try:
+        if args.if_empty and not _is_derived_missing(db, TreeCluster):
+            print("Tree clusters are up to date.")
+            return
+        rebuild_clusters(db, iter_tree_points(db))
+        print("Rebuilt tree clusters.")
+    finally:
+        db.close()
+
+
+def rebuild_stats_command(args):
+    db = SessionLocal()
+    try:
+        if args.if_empty and not _is_derived_missing(db, TreeStatsCell):
+            print("Tree statistics are up to date.")
+            return
+        rebuild_stats(db, iter_tree_points(db))
+        print("Rebuilt tree statistics.")
+    finally:
+        db.close()
+
+
+def merge_duplicates_command(args):
+    report = open(args.report, "w") if args.report else None
+    db = SessionLocal()
+    try:
+        totals = merge_duplicates(
+            db,
+            radius_m=args.radius,
+            method=args.method,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            report=report and (lambda group: report.write(json.dumps(group) + "\n")),
+        )
+        verb = "Would merge" if args.dry_run else "Merged"
+        print(
+            f"{verb} {totals['merged']} trees into {totals['groups']} groups "
+            f"out of {totals['scanned']} trees."
+        )
+    finally:
+        db.close()
+        if report:
+            report.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the backend.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser(
+        "backfill-grid-cells", help="Compute the spatial grid cell of existing trees."
+    )
+    backfill.add_argument(
+        "--all", action="store_true", help="Recompute every tree, not only missing cells."
+    )
+    backfill.set_defaults(handler=backfill_grid_cells_command)
+
+    clusters = commands.add_parser(
+        "rebuild-clusters", help="Recompute the map clusters from the trees table."
+    )
+    clusters.add_argument(
+        "--if-empty", action="store_true",
+        help="Only rebuild when there are trees but no clusters, as after a migration.",
+    )
+    clusters.set_defaults(handler=rebuild_clusters_command)
+
+    stats = commands.add_parser(
+        "rebuild-stats", help="Recompute the inventory statistics from the trees table."
+    )
+    stats.add_argument(
+        "--if-empty", action="store_true",
+        help="Only rebuild when there are trees but no statistics, as after a migration.",
+    )
+    stats.set_defaults(handler=rebuild_stats_command)
+
+    merge = commands.add_parser(
+        "merge-duplicates",
+        help="Merge groups of near-duplicate trees into one tree. Merges are not "
+        "pushed over /trees/events; clients see them in /trees/changes.",
+    )
+    merge.add_argument(
+        "--radius", type=float, default=MERGE_RADIUS_M,
+        help="Merge trees within this many metres of a group's first tree.",
+    )
+    merge.add_argument(
+        "--method", choices=sorted(MERGE_METHODS), default="median",
+        help="How the coordinates and measurements of a group are combined.",
+    )
+    merge.add_argument(
+        "--batch-size", type=int, default=MERGE_BATCH_SIZE,
+        help="Trees read, merged and committed per batch.",
+    )
+    merge.add_argument(
+        "--dry-run", action="store_true", help="Report the groups without changing anything."
+    )
+    merge.add_argument("--report", help="Write every group as a JSON line to this file.")
+    merge.set_defaults(handler=merge_duplicates_command)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
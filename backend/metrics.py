@@ -0,0 +1,192 @@
+import bisect
+import contextvars
+import threading
+import time
+from sqlalchemy import event
+
+# Upper bounds in seconds, from 1 ms to 10 s.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """A thread-safe fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Cumulative bucket counts keyed by upper bound, plus count and sum."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+
+class Counter:
+    """A thread-safe monotonically increasing value."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+# Route label for requests that matched no route; never the raw path, which
+# can carry tokens (/verify-token/{token}).
+UNMATCHED_ROUTE = "<unmatched>"
+
+_lock = threading.Lock()
+_request_seconds = {}
+_request_queries = {}
+_request_db_seconds = {}
+db_queries = Counter()
+db_seconds = Counter()
+
+# The [queries, seconds] of the request being served, shared with the
+# threadpool and run_sync greenlets that run its queries.
+_current = contextvars.ContextVar("request_db_usage", default=None)
+
+
+def _metric(metrics: dict, labels: tuple, factory):
+    metric = metrics.get(labels)
+    if metric is None:
+        with _lock:
+            metric = metrics.setdefault(labels, factory())
+    return metric
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_start
+    db_queries.inc()
+    db_seconds.inc(elapsed)
+    usage = _current.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += elapsed
+
+
+def instrument_engine(engine):
+    """Count the queries run on a sync engine, or an async engine's sync_engine."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the latency of every HTTP request, labelled by method, route
+    template and status code, and the queries and database time it used.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        usage = [0, 0.0]
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        previous = _current.set(usage)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(previous)
+            route = scope.get("route")
+            template = getattr(route, "path", UNMATCHED_ROUTE)
+            method = scope["method"]
+            _metric(_request_seconds, (method, template, str(status)), Histogram).observe(
+                elapsed
+            )
+            _metric(_request_queries, (method, template), Counter).inc(usage[0])
+            _metric(_request_db_seconds, (method, template), Counter).inc(usage[1])
+
+
+def reset_request_metrics():
+    with _lock:
+        _request_seconds.clear()
+        _request_queries.clear()
+        _request_db_seconds.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _bound(bound: float):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def histogram_lines(name: str, labels: dict, snapshot: dict):
+    for bound, count in snapshot["buckets"]:
+        yield f"{name}_bucket{_labels({**labels, 'le': _bound(bound)})} {count}"
+    yield f"{name}_sum{_labels(labels)} {snapshot['sum']}"
+    yield f"{name}_count{_labels(labels)} {snapshot['count']}"
+
+
+def request_metric_lines():
+    """The request and query metrics in the Prometheus text format."""
+    with _lock:
+        request_seconds = list(_request_seconds.items())
+        request_queries = list(_request_queries.items())
+        request_db_seconds = list(_request_db_seconds.items())
+
+    yield "# HELP http_request_duration_seconds HTTP request latency."
+    yield "# TYPE http_request_duration_seconds histogram"
+    for (method, route, status), histogram in sorted(request_seconds):
+        labels = {"method": method, "route": route, "status": status}
+        yield from histogram_lines("http_request_duration_seconds", labels, histogram.snapshot())
+
+    yield "# HELP http_request_db_queries_total Database queries run by HTTP requests."
+    yield "# TYPE http_request_db_queries_total counter"
+    for (method, route), counter in sorted(request_queries):
+        yield f"http_request_db_queries_total{_labels({'method': method, 'route': route})} {counter.value}"
+
+    yield "# HELP http_request_db_seconds_total Database time spent by HTTP requests."
+    yield "# TYPE http_request_db_seconds_total counter"
+    for (method, route), counter in sorted(request_db_seconds):
+        yield f"http_request_db_seconds_total{_labels({'method': method, 'route': route})} {counter.value}"
+
+    yield "# HELP db_queries_total Database queries run by this process."
+    yield "# TYPE db_queries_total counter"
+    yield f"db_queries_total {db_queries.value}"
+    yield "# HELP db_query_seconds_total Database time spent by this process."
+    yield "# TYPE db_query_seconds_total counter"
+    yield f"db_query_seconds_total {db_seconds.value}"
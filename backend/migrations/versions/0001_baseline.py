@@ -0,0 +1,62 @@
+"""Baseline: the schema the models used to create at import time
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Databases that were set up by the old import-time create_all already have
+these tables; they are left alone so the first `alembic upgrade head` on an
+existing deployment needs no manual stamp.
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String(50)),
+            sa.Column("hashed_password", sa.String(255)),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "trees" not in existing:
+        op.create_table(
+            "trees",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(100), nullable=False),
+            sa.Column("description", sa.String(255), nullable=True),
+            sa.Column("latitude", sa.Numeric(10, 8), nullable=False),
+            sa.Column("longitude", sa.Numeric(11, 8), nullable=False),
+            sa.Column("height", sa.Float(), nullable=True),
+            sa.Column("diameter", sa.Float(), nullable=True),
+            sa.Column("added_at", sa.DateTime(), default=datetime.utcnow),
+        )
+        op.create_index("ix_trees_id", "trees", ["id"])
+
+    if "revoked_tokens" not in existing:
+        op.create_table(
+            "revoked_tokens",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("token", sa.String(255)),
+            sa.Column("revoked_at", sa.DateTime()),
+        )
+        op.create_index("ix_revoked_tokens_id", "revoked_tokens", ["id"])
+        op.create_index("ix_revoked_tokens_token", "revoked_tokens", ["token"], unique=True)
+
+
+def downgrade():
+    op.drop_table("revoked_tokens")
+    op.drop_table("trees")
+    op.drop_table("users")
@@ -0,0 +1,157 @@
+"""Grid cells, bbox/range indexes, tree clusters and token digests
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+The grid cells of existing trees are filled in here. The clusters are
+rebuilt by `start.sh migrate` (`python manage.py rebuild-clusters --if-empty`).
+"""
+import hashlib
+import math
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+from jose import JWTError, jwt
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _expiry(token: str):
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+    if exp is None:
+        return None
+    return datetime.fromtimestamp(exp, timezone.utc).replace(tzinfo=None)
+
+
+# Frozen copy of services.spatial_service.grid_cell with 10 m cells, the keys
+# this revision introduces.
+GRID_CELL_M = 10
+METRES_PER_DEGREE = 111_320
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _grid_cell(lat: float, lon: float):
+    step = GRID_CELL_M / METRES_PER_DEGREE
+    row = math.floor((lat + 90) / step)
+    row_lat = -90 + (row + 0.5) * step
+    col_step = step / max(math.cos(math.radians(row_lat)), 0.01)
+    return (row << 32) | math.floor((lon + 180) / col_step)
+
+
+def _backfill_grid_cells(bind):
+    trees = sa.table(
+        "trees",
+        sa.column("id", sa.Integer()),
+        sa.column("latitude", sa.Numeric()),
+        sa.column("longitude", sa.Numeric()),
+        sa.column("grid_cell", sa.BigInteger()),
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(trees.c.id, trees.c.latitude, trees.c.longitude)
+            .where(trees.c.id > last_id)
+            .order_by(trees.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        bind.execute(
+            trees.update()
+            .where(trees.c.id == sa.bindparam("tree_id"))
+            .values(grid_cell=sa.bindparam("cell")),
+            [
+                {
+                    "tree_id": row.id,
+                    "cell": _grid_cell(float(row.latitude), float(row.longitude)),
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table("trees") as batch:
+        batch.add_column(sa.Column("grid_cell", sa.BigInteger(), nullable=True))
+        batch.create_index("ix_trees_grid_cell", ["grid_cell"])
+        batch.create_index("ix_trees_latitude_longitude", ["latitude", "longitude"])
+        batch.create_index("ix_trees_height_diameter", ["height", "diameter"])
+    # Without a cell, create_tree would never see the existing trees as
+    # duplicates.
+    _backfill_grid_cells(op.get_bind())
+
+    op.create_table(
+        "tree_clusters",
+        sa.Column("zoom", sa.Integer(), primary_key=True),
+        sa.Column("cell_x", sa.Integer(), primary_key=True),
+        sa.Column("cell_y", sa.Integer(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("latitude_sum", sa.Float(), nullable=False),
+        sa.Column("longitude_sum", sa.Float(), nullable=False),
+        sa.Column("height_count", sa.Integer(), nullable=False),
+        sa.Column("height_sum", sa.Float(), nullable=False),
+        sa.Column("diameter_count", sa.Integer(), nullable=False),
+        sa.Column("diameter_sum", sa.Float(), nullable=False),
+    )
+
+    # Replace the stored raw JWTs with their SHA-256 digest and expiry.
+    with op.batch_alter_table("revoked_tokens") as batch:
+        batch.add_column(sa.Column("token_hash", sa.String(64), nullable=True))
+        batch.add_column(sa.Column("expires_at", sa.DateTime(), nullable=True))
+
+    revoked_tokens = sa.table(
+        "revoked_tokens",
+        sa.column("id", sa.Integer()),
+        sa.column("token", sa.String()),
+        sa.column("token_hash", sa.String()),
+        sa.column("expires_at", sa.DateTime()),
+    )
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(revoked_tokens.c.id, revoked_tokens.c.token)).all()
+    for row_id, token in rows:
+        if token is None:
+            continue
+        bind.execute(
+            revoked_tokens.update()
+            .where(revoked_tokens.c.id == row_id)
+            .values(
+                token_hash=hashlib.sha256(token.encode()).hexdigest(),
+                expires_at=_expiry(token),
+            )
+        )
+    bind.execute(revoked_tokens.delete().where(revoked_tokens.c.token_hash.is_(None)))
+
+    with op.batch_alter_table("revoked_tokens") as batch:
+        batch.drop_index("ix_revoked_tokens_token")
+        batch.drop_column("token")
+        batch.alter_column("token_hash", existing_type=sa.String(64), nullable=False)
+        batch.create_index("ix_revoked_tokens_token_hash", ["token_hash"], unique=True)
+        batch.create_index("ix_revoked_tokens_expires_at", ["expires_at"])
+
+
+def downgrade():
+    # Revocations cannot be turned back into raw tokens; they are dropped.
+    op.execute("DELETE FROM revoked_tokens")
+    with op.batch_alter_table("revoked_tokens") as batch:
+        batch.drop_index("ix_revoked_tokens_expires_at")
+        batch.drop_index("ix_revoked_tokens_token_hash")
+        batch.drop_column("expires_at")
+        batch.drop_column("token_hash")
+        batch.add_column(sa.Column("token", sa.String(255)))
+        batch.create_index("ix_revoked_tokens_token", ["token"], unique=True)
+
+    op.drop_table("tree_clusters")
+
+    with op.batch_alter_table("trees") as batch:
+        batch.drop_index("ix_trees_height_diameter")
+        batch.drop_index("ix_trees_latitude_longitude")
+        batch.drop_index("ix_trees_grid_cell")
+        batch.drop_column("grid_cell")
@@ -0,0 +1,51 @@
+"""Tree change feed: updated_at, change_seq, tombstones and the sequence row
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Existing trees get change_seq 1, so a client following the feed from the
+start receives every tree.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("trees") as batch:
+        batch.add_column(sa.Column("updated_at", sa.DateTime(), nullable=True))
+        batch.add_column(sa.Column("change_seq", sa.BigInteger(), nullable=True))
+        batch.create_index("ix_trees_change_seq_id", ["change_seq", "id"])
+
+    op.create_table(
+        "tree_tombstones",
+        sa.Column("tree_id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("change_seq", sa.BigInteger(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime()),
+    )
+    op.create_index(
+        "ix_tree_tombstones_change_seq_tree_id", "tree_tombstones", ["change_seq", "tree_id"]
+    )
+
+    change_sequence = op.create_table(
+        "change_sequence",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("value", sa.BigInteger(), nullable=False),
+    )
+    op.bulk_insert(change_sequence, [{"id": 1, "value": 1}])
+    op.execute("UPDATE trees SET change_seq = 1, updated_at = added_at")
+
+
+def downgrade():
+    op.drop_table("change_sequence")
+    op.drop_index("ix_tree_tombstones_change_seq_tree_id", table_name="tree_tombstones")
+    op.drop_table("tree_tombstones")
+    with op.batch_alter_table("trees") as batch:
+        batch.drop_index("ix_trees_change_seq_id")
+        batch.drop_column("change_seq")
+        batch.drop_column("updated_at")
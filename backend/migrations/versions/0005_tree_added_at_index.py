@@ -0,0 +1,20 @@
+"""Index trees.added_at for the bulk time-range filters
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_trees_added_at", "trees", ["added_at"])
+
+
+def downgrade():
+    op.drop_index("ix_trees_added_at", table_name="trees")
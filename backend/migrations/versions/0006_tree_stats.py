@@ -0,0 +1,46 @@
+"""Incrementally maintained tree statistics per grid cell
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+The new tables are filled by `start.sh migrate`
+(`python manage.py rebuild-stats --if-empty`).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tree_stats_cells",
+        sa.Column("level", sa.Integer(), primary_key=True),
+        sa.Column("cell_x", sa.Integer(), primary_key=True),
+        sa.Column("cell_y", sa.Integer(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("height_count", sa.Integer(), nullable=False),
+        sa.Column("height_sum", sa.Float(), nullable=False),
+        sa.Column("height_sumsq", sa.Float(), nullable=False),
+        sa.Column("diameter_count", sa.Integer(), nullable=False),
+        sa.Column("diameter_sum", sa.Float(), nullable=False),
+        sa.Column("diameter_sumsq", sa.Float(), nullable=False),
+    )
+    op.create_table(
+        "tree_stats_bins",
+        sa.Column("level", sa.Integer(), primary_key=True),
+        sa.Column("cell_x", sa.Integer(), primary_key=True),
+        sa.Column("cell_y", sa.Integer(), primary_key=True),
+        sa.Column("metric", sa.String(16), primary_key=True),
+        sa.Column("bin", sa.Integer(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("tree_stats_bins")
+    op.drop_table("tree_stats_cells")
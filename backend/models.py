@@ -1,31 +0,0 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float
-from datetime import datetime
-from database import Base
-from database import Base, engine
-
-class User(Base):
-    __tablename__ = "users"
-
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(50), unique=True, index=True)
-    hashed_password = Column(String(255))
-
-class RevokedToken(Base):
-    __tablename__ = "revoked_tokens"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    token = Column(String(255), unique=True, index=True)
-    revoked_at = Column(DateTime, default=datetime.utcnow)
-
-class Tree(Base):
-    __tablename__ = "trees"
-
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(100), nullable=False)
-    description = Column(String(255), nullable=True)
-    latitude = Column(Float, nullable=False)
-    longitude = Column(Float, nullable=False)
-    height = Column(Float, nullable=True)
-    diameter = Column(Float, nullable=True)
-    added_at = Column(DateTime, default=datetime.utcnow)
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -1,3 +1,8 @@
 from .user_model import User
 from .tree_model import Tree
 from .revoked_token_model import RevokedToken
+from .tree_cluster_model import TreeCluster
+from .tree_tombstone_model import TreeTombstone
+from .change_sequence_model import ChangeSequence
+from .import_job_model import ImportJob
+from .tree_stats_model import TreeStatsBin, TreeStatsCell
@@ -0,0 +1,14 @@
+from sqlalchemy import BigInteger, Column, Integer
+from database import Base
+
+
+class ChangeSequence(Base):
+    """
+    The last change sequence number handed out. Its single row is locked by
+    every tree-mutating transaction until commit, so sequence numbers become
+    visible in order.
+    """
+    __tablename__ = "change_sequence"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(BigInteger, nullable=False)
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from datetime import datetime
+from database import Base
+
+
+class ImportJob(Base):
+    """A GeoJSON upload processed in the background by services.import_service."""
+    __tablename__ = "import_jobs"
+
+    id = Column(String(32), primary_key=True)
+    # queued, running, done or failed
+    status = Column(String(16), nullable=False, default="queued")
+    filename = Column(String(255), nullable=True)
+    processed = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    # JSON list of the first rejected features and why, or the job's failure.
+    error_samples = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
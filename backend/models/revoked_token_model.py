@@ -1,13 +1,14 @@
 from sqlalchemy import Column, Integer, String, DateTime
 from datetime import datetime
-from database import Base, engine
+from database import Base
 
 
 class RevokedToken(Base):
     __tablename__ = "revoked_tokens"
 
     id = Column(Integer, primary_key=True, index=True)
-    token = Column(String(255), unique=True, index=True)
+    # SHA-256 hex digest of the JWT, see services.revocation_service.token_digest.
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # The token's own exp; the row is useless afterwards and gets swept.
+    expires_at = Column(DateTime, nullable=True, index=True)
     revoked_at = Column(DateTime, default=datetime.utcnow)
-
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Float, Integer
+from database import Base
+
+
+class TreeCluster(Base):
+    """
+    Running totals of the trees inside one map grid cell at one zoom level,
+    maintained by services.cluster_service whenever trees change.
+    """
+    __tablename__ = "tree_clusters"
+
+    zoom = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    latitude_sum = Column(Float, nullable=False, default=0)
+    longitude_sum = Column(Float, nullable=False, default=0)
+    height_count = Column(Integer, nullable=False, default=0)
+    height_sum = Column(Float, nullable=False, default=0)
+    diameter_count = Column(Integer, nullable=False, default=0)
+    diameter_sum = Column(Float, nullable=False, default=0)
@@ -1,10 +1,19 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric
+from sqlalchemy import BigInteger, Column, Index, Integer, String, Float, DateTime, Numeric
 from datetime import datetime
-from database import Base, engine
+from database import Base
 
 
 class Tree(Base):
     __tablename__ = "trees"
+    __table_args__ = (
+        # Serve the bounding-box and range filters of GET /trees.
+        Index("ix_trees_latitude_longitude", "latitude", "longitude"),
+        Index("ix_trees_height_diameter", "height", "diameter"),
+        # Keyset order of GET /trees/changes.
+        Index("ix_trees_change_seq_id", "change_seq", "id"),
+        # Time-range filters of the bulk update and delete endpoints.
+        Index("ix_trees_added_at", "added_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
@@ -14,5 +23,9 @@ class Tree(Base):
     height = Column(Float, nullable=True)
     diameter = Column(Float, nullable=True)
     added_at = Column(DateTime, default=datetime.utcnow)
-
-Base.metadata.create_all(bind=engine)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # services.change_service sequence number of the last insert or update.
+    change_seq = Column(BigInteger, nullable=True)
+    # services.spatial_service.grid_cell of the coordinates, used for the
+    # near-duplicate lookup in create_tree.
+    grid_cell = Column(BigInteger, nullable=True, index=True)
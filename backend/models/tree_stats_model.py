@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Float, Integer, String
+from database import Base
+
+
+class TreeStatsCell(Base):
+    """
+    Count, sum and sum of squares of the heights and diameters of the trees
+    inside one latitude/longitude cell at one level, maintained by
+    services.stats_service whenever trees change.
+    """
+    __tablename__ = "tree_stats_cells"
+
+    level = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    height_count = Column(Integer, nullable=False, default=0)
+    height_sum = Column(Float, nullable=False, default=0)
+    height_sumsq = Column(Float, nullable=False, default=0)
+    diameter_count = Column(Integer, nullable=False, default=0)
+    diameter_sum = Column(Float, nullable=False, default=0)
+    diameter_sumsq = Column(Float, nullable=False, default=0)
+
+
+class TreeStatsBin(Base):
+    """Trees of one stats cell whose height or diameter falls in one histogram bin."""
+    __tablename__ = "tree_stats_bins"
+
+    level = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    metric = Column(String(16), primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,15 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer
+from datetime import datetime
+from database import Base
+
+
+class TreeTombstone(Base):
+    """A deleted tree, kept so GET /trees/changes can report the delete."""
+    __tablename__ = "tree_tombstones"
+    __table_args__ = (
+        Index("ix_tree_tombstones_change_seq_tree_id", "change_seq", "tree_id"),
+    )
+
+    tree_id = Column(Integer, primary_key=True, autoincrement=False)
+    change_seq = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
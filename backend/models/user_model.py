@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String
-from database import Base, engine
+from database import Base
 
 
 class User(Base):
@@ -8,4 +8,3 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True)
     hashed_password = Column(String(255))
-Base.metadata.create_all(bind=engine)
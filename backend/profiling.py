@@ -0,0 +1,137 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from sqlalchemy import event
+
+# Query profiling is off unless DB_PROFILE=1. When on, statements slower than
+# DB_PROFILE_SLOW_MS and statement templates a single request repeats more
+# than DB_PROFILE_REPEAT_LIMIT times are written as JSON lines to
+# DB_PROFILE_LOG, or stderr when it is not set.
+PROFILE_ENABLED = os.getenv("DB_PROFILE", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("DB_PROFILE_SLOW_MS", "100"))
+REPEAT_LIMIT = int(os.getenv("DB_PROFILE_REPEAT_LIMIT", "10"))
+PROFILE_LOG = os.getenv("DB_PROFILE_LOG")
+
+logger = logging.getLogger("query_profile")
+
+# Expanded IN lists and multi-row VALUES differ in length from call to call;
+# collapse them so they count as one template.
+_PLACEHOLDER_LIST = re.compile(r"(\?|%s|%\(\w+\)s)(\s*,\s*(\?|%s|%\(\w+\)s))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _RequestProfile:
+    __slots__ = ("scope", "templates", "seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.templates = Counter()
+        self.seconds = Counter()
+
+    @property
+    def route(self):
+        route = self.scope.get("route")
+        return getattr(route, "path", None)
+
+
+_current = contextvars.ContextVar("query_profile", default=None)
+
+
+def statement_template(statement: str):
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return _PLACEHOLDER_LIST.sub(r"\1, ...", statement)
+
+
+def parameter_shape(parameters, executemany: bool = False):
+    """The types of the bound parameters, never their values."""
+    if executemany:
+        rows = list(parameters or ())
+        return {"rows": len(rows), "row": parameter_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _log(record: dict):
+    logger.warning(json.dumps({"ts": time.time(), **record}, default=str))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.profile_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.profile_start
+    template = statement_template(statement)
+    profile = _current.get()
+    if profile is not None:
+        profile.templates[template] += 1
+        profile.seconds[template] += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _log(
+            {
+                "event": "slow_query",
+                "route": profile.route if profile is not None else None,
+                "method": profile.scope["method"] if profile is not None else None,
+                "template": template,
+                "parameters": parameter_shape(parameters, executemany),
+                "duration_ms": round(elapsed * 1000, 3),
+            }
+        )
+
+
+def _report_repeats(profile: _RequestProfile):
+    for template, count in profile.templates.items():
+        if count > REPEAT_LIMIT:
+            _log(
+                {
+                    "event": "repeated_query",
+                    "route": profile.route,
+                    "method": profile.scope["method"],
+                    "template": template,
+                    "count": count,
+                    "total_ms": round(profile.seconds[template] * 1000, 3),
+                }
+            )
+
+
+def profile_engine(engine):
+    """Profile the statements run on a sync engine, or an async engine's sync_engine."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def configure_profile_log():
+    if logger.handlers:
+        return
+    handler = logging.FileHandler(PROFILE_LOG) if PROFILE_LOG else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class QueryProfilerMiddleware:
+    """Tracks the statements each HTTP request runs and reports repeated ones."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = _RequestProfile(scope)
+        previous = _current.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(previous)
+            _report_repeats(profile)
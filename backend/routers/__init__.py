@@ -1,3 +1,6 @@
 from .user_router import router as user_router
 from .tree_router import router as tree_router
-from .token_router import router as token_router
\ No newline at end of file
+from .token_router import router as token_router
+from .internal_router import router as internal_router
+from .metrics_router import router as metrics_router
+from .import_router import router as import_router
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from database import DbSession, get_db, run_db
+from routers.tree_router import authorize, oauth2_scheme
+from services.import_service import (
+    create_import_job,
+    discard_upload,
+    get_import_job,
+    import_dir,
+    import_job_dict,
+    new_import_id,
+    queue_import,
+    save_upload,
+)
+
+router = APIRouter()
+
+
+@router.post("/imports", status_code=202)
+async def create_import(
+    request: Request,
+    response: Response,
+    filename: str | None = None,
+    db: DbSession = Depends(get_db),
+    token_param: str = Depends(oauth2_scheme),
+):
+    """
+    Queue a GeoJSON FeatureCollection of any size, sent as the request body,
+    for import. The body is streamed to disk and imported in the background;
+    poll the returned URL for progress.
+    """
+    await authorize(request, db)
+    if import_dir() is None:
+        raise HTTPException(status_code=503, detail="Imports are not configured.")
+    job_id = new_import_id()
+    # Saved before the job exists, so a failed upload leaves no job behind.
+    path = await save_upload(request.stream(), job_id)
+    try:
+        await run_db(db, lambda session: create_import_job(session, job_id, filename))
+    except BaseException:
+        await run_in_threadpool(discard_upload, path)
+        raise
+    queue_import(job_id, path)
+    url = f"/imports/{job_id}"
+    response.headers["Location"] = url
+    return {"id": job_id, "status": "queued", "url": url}
+
+
+@router.get("/imports/{job_id}")
+async def get_import(
+    job_id: str,
+    request: Request,
+    db: DbSession = Depends(get_db),
+    token_param: str = Depends(oauth2_scheme),
+):
+    await authorize(request, db)
+
+    def load(session):
+        job = get_import_job(session, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Import not found")
+        return import_job_dict(job)
+
+    return await run_db(db, load)
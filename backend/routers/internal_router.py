@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from database import async_engine, engine, pool_stats
+from services.token_service import token_cache_stats
+
+# Operational endpoints, left out of the public API documentation.
+router = APIRouter(prefix="/internal", include_in_schema=False)
+
+
+@router.get("/token-cache")
+def get_token_cache_stats():
+    return token_cache_stats()
+
+
+@router.get("/pool")
+def get_pool_stats():
+    stats = {"sync": pool_stats(engine)}
+    if async_engine is not None:
+        stats["async"] = pool_stats(async_engine.sync_engine)
+    return stats
@@ -0,0 +1,48 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from database import async_engine, engine, pool_stats
+from metrics import histogram_lines, request_metric_lines
+from services.token_service import token_cache_stats
+
+router = APIRouter(include_in_schema=False)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _pool_lines():
+    pools = {"sync": engine}
+    if async_engine is not None:
+        pools["async"] = async_engine.sync_engine
+    stats = {name: pool_stats(pool) for name, pool in pools.items()}
+
+    yield "# HELP db_pool_checked_out Connections currently checked out."
+    yield "# TYPE db_pool_checked_out gauge"
+    for name, pool in stats.items():
+        if "checked_out" in pool:
+            yield f'db_pool_checked_out{{pool="{name}"}} {pool["checked_out"]}'
+    yield "# HELP db_pool_checkout_timeouts_total Checkouts that timed out."
+    yield "# TYPE db_pool_checkout_timeouts_total counter"
+    for name, pool in stats.items():
+        if "timeouts" in pool:
+            yield f'db_pool_checkout_timeouts_total{{pool="{name}"}} {pool["timeouts"]}'
+    yield "# HELP db_pool_checkout_wait_seconds Time spent waiting for a connection."
+    yield "# TYPE db_pool_checkout_wait_seconds histogram"
+    for name, pool in stats.items():
+        if "wait_seconds" in pool:
+            yield from histogram_lines(
+                "db_pool_checkout_wait_seconds", {"pool": name}, pool["wait_seconds"]
+            )
+
+
+def _token_cache_lines():
+    stats = token_cache_stats()
+    yield "# HELP token_cache_lookups_total Token cache lookups by result."
+    yield "# TYPE token_cache_lookups_total counter"
+    yield f'token_cache_lookups_total{{result="hit"}} {stats["hits"]}'
+    yield f'token_cache_lookups_total{{result="miss"}} {stats["misses"]}'
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    lines = [*request_metric_lines(), *_pool_lines(), *_token_cache_lines()]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=PROMETHEUS_MEDIA_TYPE)
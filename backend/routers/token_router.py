@@ -1,8 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from services.token_service import revoke_token, verify_token
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, get_db, run_db
 
 router = APIRouter()
 
@@ -17,21 +16,21 @@ def standard_response(success: bool, message: str, data: dict | None = None):
 
 
 @router.get("/verify-token/{token}")
-def verify_user_token(token: str, db: Session = Depends(get_db)):
+async def verify_user_token(token: str, db: DbSession = Depends(get_db)):
     """
     Verify the validity of a token.
     """
-    verify_token(token, db)
+    await run_db(db, lambda session: verify_token(token, session))
     return standard_response(True, "Token is valid")
 
 
 @router.post("/revoke-token/{token}")
-def revoke_user_token(token: str, db: Session = Depends(get_db)):
+async def revoke_user_token(token: str, db: DbSession = Depends(get_db)):
     """
     Revoke a token, making it unusable for future authentication.
     """
     try:
-        revoke_token(token, db)
+        await run_db(db, lambda session: revoke_token(token, session))
         return standard_response(True, "Token has been revoked.")
     except HTTPException as e:
         raise HTTPException(
@@ -1,16 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+import orjson
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
+from compression import MIN_COMPRESS_BYTES, compress, negotiate_encoding
+from services.cache_service import get_or_load
+from services.change_service import current_change_seq
+from services.cluster_service import get_clusters
+from services.event_service import get_hub
+from services.nearest_service import nearest_trees
+from services.polygon_service import parse_polygons, trees_within
+from services.snapshot_service import SNAPSHOT_MEDIA_TYPE, build_snapshot
+from services.stats_service import get_stats
 from services.token_service import verify_token
-from services.tree_service import create_tree, delete_tree, update_tree, get_all_trees
-from pydantic import BaseModel
+from services.tree_service import (
+    GEOJSON_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    TREE_COLUMNS,
+    bulk_create_trees,
+    bulk_delete_trees,
+    bulk_update_trees,
+    create_tree,
+    decode_change_cursor,
+    decode_cursor,
+    delete_tree,
+    encode_change_cursor,
+    encode_cursor,
+    encode_trees,
+    get_tree_changes,
+    get_trees_page,
+    stream_tree_features,
+    tree_dict,
+    tree_feature,
+    update_tree,
+    get_all_trees,
+    tree_from_feature,
+)
+from pydantic import BaseModel, ValidationError
 from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, get_db, get_sync_db, run_db
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 BEARER_PREFIX = "Bearer "
 AUTH_ERROR = "Missing or invalid Authorization header."
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+CHANGE_CURSOR_HEADER = "X-Change-Cursor"
+EVENTS_KEEPALIVE_SECONDS = 15
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
 
 
 class TreeCreate(BaseModel):
@@ -25,53 +67,520 @@ class TreeUpdate(BaseModel):
     diameter: float | None = None
 
 
+class TreeBulkFilter(BaseModel):
+    min_lat: float | None = None
+    min_lon: float | None = None
+    max_lat: float | None = None
+    max_lon: float | None = None
+    min_height: float | None = None
+    max_height: float | None = None
+    min_diameter: float | None = None
+    max_diameter: float | None = None
+    added_after: datetime | None = None
+    added_before: datetime | None = None
+
+
+class TreeBulkChange(TreeUpdate):
+    id: int
+
+
+class TreeBulkUpdate(BaseModel):
+    trees: list[TreeBulkChange] | None = None
+    filter: TreeBulkFilter | None = None
+    values: TreeUpdate | None = None
+
+
+class TreeBulkDelete(BaseModel):
+    ids: list[int] | None = None
+    filter: TreeBulkFilter | None = None
+
+
+async def authorize(request: Request, db: DbSession):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith(BEARER_PREFIX):
+        raise HTTPException(status_code=401, detail=AUTH_ERROR)
+    token = auth_header[len(BEARER_PREFIX):]
+    return await run_db(db, lambda session: verify_token(token, session))
+
+
+def tree_filters(
+    min_lat: float | None = None,
+    min_lon: float | None = None,
+    max_lat: float | None = None,
+    max_lon: float | None = None,
+    min_height: float | None = None,
+    max_height: float | None = None,
+    min_diameter: float | None = None,
+    max_diameter: float | None = None,
+):
+    filters = {
+        "min_lat": min_lat,
+        "min_lon": min_lon,
+        "max_lat": max_lat,
+        "max_lon": max_lon,
+        "min_height": min_height,
+        "max_height": max_height,
+        "min_diameter": min_diameter,
+        "max_diameter": max_diameter,
+    }
+    return {name: value for name, value in filters.items() if value is not None}
+
+
+def _streaming_media_type(request: Request):
+    accept = request.headers.get("Accept", "")
+    for media_type in (GEOJSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE):
+        if media_type in accept:
+            return media_type
+    return None
+
+
+def _if_none_match(request: Request, etag: str):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _change_stamp(db: DbSession):
+    """get_or_load stamp: the change sequence every mutation moves."""
+    return lambda: run_db(db, current_change_seq)
+
+
+def _tree_listing(db: Session, filters: dict, limit: int | None, cursor: str | None):
+    # Read before the trees, so changes racing with the listing are replayed
+    # rather than missed by a client that syncs from this cursor.
+    change_seq = current_change_seq(db)
+    if not filters and limit is None and cursor is None:
+        trees, next_id = get_all_trees(db), None
+    else:
+        if cursor is not None and limit is None:
+            limit = DEFAULT_PAGE_SIZE
+        after_id = decode_cursor(cursor) if cursor is not None else None
+        trees, next_id = get_trees_page(db, filters, limit, after_id)
+    body = encode_trees(trees)
+    headers = {
+        "ETag": f'"{hashlib.sha1(body).hexdigest()}"',
+        CHANGE_CURSOR_HEADER: encode_change_cursor(change_seq),
+    }
+    if next_id is not None:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(next_id)
+    # Compressed variants are added by content-coding as clients ask for them,
+    # so a cached listing is compressed at most once per encoding.
+    return {None: body}, headers
+
+
+async def _encoded_response(request: Request, bodies: dict, headers: dict):
+    encoding = None
+    if len(bodies[None]) >= MIN_COMPRESS_BYTES:
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = f'{headers["ETag"][:-1]}-{encoding}"'
+    if _if_none_match(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    body = bodies.get(encoding)
+    if body is None:
+        body = await run_in_threadpool(compress, bodies[None], encoding)
+        bodies[encoding] = body
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.get("/trees")
-def get_trees(db: Session = Depends(get_db)):
-    return get_all_trees(db)
+async def get_trees(
+    request: Request,
+    filters: dict = Depends(tree_filters),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: Session = Depends(get_sync_db),
+):
+    """
+    List trees, optionally limited to a bounding box and height/diameter
+    ranges. With limit (or cursor) the result is paginated by id and the
+    cursor for the next page is returned in the X-Next-Cursor header.
+
+    Clients sending Accept: application/geo+json or application/x-ndjson get
+    the matching trees streamed as GeoJSON Features instead.
+
+    JSON responses are cached per tree-collection version and carry an ETag;
+    a matching If-None-Match is answered with 304 Not Modified. They are
+    brotli or gzip compressed when the client accepts it. The X-Change-Cursor
+    header is where to start following GET /trees/changes from.
+    """
+    media_type = _streaming_media_type(request)
+    if media_type:
+        # A sync generator, so Starlette encodes every chunk in the threadpool.
+        features = stream_tree_features(db, filters, media_type)
+        return StreamingResponse(features, media_type=media_type)
+    key = ("trees", tuple(sorted(request.query_params.multi_items())))
+    bodies, headers = await get_or_load(
+        key,
+        lambda: run_db(
+            db, lambda session: _tree_listing(session, filters, limit, cursor)
+        ),
+        _change_stamp(db),
+    )
+    return await _encoded_response(request, bodies, headers)
+
+
+@router.get("/trees/clusters")
+async def get_tree_clusters(
+    request: Request,
+    z: int = Query(..., ge=0),
+    min_lat: float | None = None,
+    min_lon: float | None = None,
+    max_lat: float | None = None,
+    max_lon: float | None = None,
+    db: DbSession = Depends(get_db),
+):
+    """
+    Pre-aggregated tree clusters for map zoom level z inside the bounding
+    box, with their count, centroid and average height and diameter.
+    """
+    bbox = {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}
+    key = ("clusters", tuple(sorted(request.query_params.multi_items())))
+    return await get_or_load(
+        key,
+        lambda: run_db(db, lambda session: get_clusters(session, z, bbox)),
+        _change_stamp(db),
+    )
+
+
+def _check_bbox(bbox: dict):
+    for axis in ("lat", "lon"):
+        low, high = bbox[f"min_{axis}"], bbox[f"max_{axis}"]
+        if low is not None and high is not None and low > high:
+            raise HTTPException(
+                status_code=422, detail=f"min_{axis} must not exceed max_{axis}."
+            )
+
+
+@router.get("/trees/stats")
+async def get_tree_stats(
+    request: Request,
+    min_lat: float | None = Query(None, ge=-90, le=90),
+    min_lon: float | None = Query(None, ge=-180, le=180),
+    max_lat: float | None = Query(None, ge=-90, le=90),
+    max_lon: float | None = Query(None, ge=-180, le=180),
+    cells: bool = False,
+    db: DbSession = Depends(get_db),
+):
+    """
+    Tree count and height/diameter count, mean, standard deviation and
+    histograms inside the bounding box, from incrementally maintained
+    per-cell aggregates. The box is widened to whole cells; with cells=true
+    the count of every cell is included.
+    """
+    bbox = {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}
+    _check_bbox(bbox)
+    key = ("stats", tuple(sorted(request.query_params.multi_items())))
+    return await get_or_load(
+        key,
+        lambda: run_db(db, lambda session: get_stats(session, bbox, cells)),
+        _change_stamp(db),
+    )
+
+
+@router.get("/trees/changes")
+async def get_tree_changes_route(
+    since: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: DbSession = Depends(get_db),
+):
+    """
+    Trees inserted, updated or deleted after the since cursor, oldest first.
+    Without since the feed starts at the beginning. Pass the returned cursor
+    as since to get the next changes; has_more means another page is ready.
+    """
+    seq, tree_id = decode_change_cursor(since) if since else (0, None)
+    changes, has_more = await run_db(
+        db, lambda session: get_tree_changes(session, seq, tree_id, limit)
+    )
+    if changes:
+        seq, tree_id = changes[-1][:2]
+    return {
+        "changes": [change for _, _, change in changes],
+        "cursor": encode_change_cursor(seq, tree_id),
+        "has_more": has_more,
+    }
+
+
+async def _event_stream(hub, subscription):
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                # Fell behind; the client resyncs through /trees/changes.
+                yield "event: overflow\ndata: {}\n\n"
+                return
+            data = orjson.dumps({**event, "cursor": encode_change_cursor(event["seq"])})
+            yield f"id: {event['seq']}\nevent: trees\ndata: {data.decode()}\n\n"
+    finally:
+        hub.unsubscribe(subscription)
+
+
+@router.get("/trees/events")
+async def get_tree_events(
+    min_lat: float | None = None,
+    min_lon: float | None = None,
+    max_lat: float | None = None,
+    max_lon: float | None = None,
+):
+    """
+    Server-Sent Events stream of committed tree changes inside the bounding
+    box. Each "trees" event holds the changes of one transaction and the
+    GET /trees/changes cursor that follows them. Only changes made by this
+    API process are pushed, unless a broker-backed hub is installed.
+    """
+    bbox = {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}
+    bbox = {name: value for name, value in bbox.items() if value is not None}
+    hub = get_hub()
+    subscription = hub.subscribe(bbox)
+    return StreamingResponse(
+        _event_stream(hub, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _snapshot(db: Session):
+    body = build_snapshot(db)
+    return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+@router.get("/trees/snapshot")
+async def get_tree_snapshot(request: Request, db: Session = Depends(get_sync_db)):
+    """
+    Every tree as a compact MessagePack snapshot for the mobile map, see
+    services.snapshot_service for the format. Cached per tree-collection
+    version and answered with 304 Not Modified on a matching If-None-Match.
+    """
+    body, etag = await get_or_load(
+        ("snapshot",), lambda: run_db(db, _snapshot), _change_stamp(db)
+    )
+    headers = {"ETag": etag}
+    if _if_none_match(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=SNAPSHOT_MEDIA_TYPE, headers=headers)
+
+
+@router.get("/trees/nearest")
+async def get_nearest_trees(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=100),
+    max_distance_m: float | None = Query(None, gt=0),
+    db: Session = Depends(get_sync_db),
+):
+    """
+    The k trees closest to (lat, lon), nearest first, with their great-circle
+    distance in metres. Served from an in-memory grid index. Only trees within
+    max_distance_m, and never beyond TREE_NEAREST_MAX_DISTANCE_M (10 km by
+    default), are returned, so the list can be shorter than k.
+    """
+    nearest = await run_db(
+        db, lambda session: nearest_trees(session, lat, lon, k, max_distance_m)
+    )
+    return [
+        {**point._asdict(), "distance_m": round(distance, 2)}
+        for distance, point in nearest
+    ]
+
+
+def _trees_within(db: Session, polygons: list, output: str):
+    if output == "features":
+        rows = trees_within(db, polygons, TREE_COLUMNS)
+        return {"type": "FeatureCollection", "features": [tree_feature(row) for row in rows]}
+    ids = [row.id for row in trees_within(db, polygons)]
+    if output == "count":
+        return {"count": len(ids)}
+    return {"count": len(ids), "ids": ids}
+
+
+@router.post("/trees/within")
+async def get_trees_within(
+    geometry: dict = Body(...),
+    output: str = Query("ids", pattern="^(ids|features|count)$"),
+    db: Session = Depends(get_sync_db),
+):
+    """
+    The trees inside a GeoJSON Polygon or MultiPolygon, with [latitude,
+    longitude] positions: their ids, a FeatureCollection or only a count.
+    """
+    try:
+        polygons = await run_in_threadpool(parse_polygons, geometry)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result = await run_db(db, lambda session: _trees_within(session, polygons, output))
+    media_type = GEOJSON_MEDIA_TYPE if output == "features" else "application/json"
+    return Response(orjson.dumps(result), media_type=media_type)
 
 
 @router.post("/trees")
-def create_tree_route(
+async def create_tree_route(
     tree: TreeCreate,
     request: Request,
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_db),
     token_param: str = Depends(oauth2_scheme),
 ):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith(BEARER_PREFIX):
-        raise HTTPException(status_code=401, detail=AUTH_ERROR)
-    token = auth_header[len(BEARER_PREFIX):]
-    print(token)
-    verify_token(token, db)
-    return create_tree(tree, db)
+    await authorize(request, db)
+    return await run_db(db, lambda session: tree_dict(create_tree(tree, session)))
+
+
+def _bulk_items(payload: dict | list):
+    if isinstance(payload, list):
+        return payload, False
+    if payload.get("type") == "FeatureCollection" and isinstance(
+        payload.get("features"), list
+    ):
+        return payload["features"], True
+    raise HTTPException(
+        status_code=422,
+        detail="Expected a GeoJSON FeatureCollection or a list of trees.",
+    )
+
+
+def _parse_bulk_items(items: list, is_geojson: bool):
+    rejected = {}
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            if is_geojson:
+                values = tree_from_feature(item)
+            else:
+                values = TreeCreate(**item).dict() if isinstance(item, dict) else None
+                if values is None:
+                    raise ValueError("Tree is not an object.")
+            valid.append((index, values))
+        except (ValueError, ValidationError) as e:
+            rejected[index] = {"index": index, "status": "rejected", "detail": str(e)}
+    return valid, rejected
+
+
+@router.post("/trees/bulk")
+async def bulk_create_trees_route(
+    request: Request,
+    payload: dict | list = Body(...),
+    db: Session = Depends(get_sync_db),
+    token_param: str = Depends(oauth2_scheme),
+):
+    """
+    Add a whole GeoJSON FeatureCollection, or a list of trees, in one request.
+    Trees near an existing tree, or near an earlier tree in the same upload,
+    are reported as duplicates instead of being inserted.
+    """
+    await authorize(request, db)
+    items, is_geojson = _bulk_items(payload)
+    valid, rejected = await run_in_threadpool(_parse_bulk_items, items, is_geojson)
+    inserted = await run_db(db, lambda session: bulk_create_trees(valid, session))
+    results = {**rejected, **inserted}
+    results = [results[index] for index in range(len(items))]
+    return {
+        "inserted": sum(r["status"] == "inserted" for r in results),
+        "duplicates": sum(r["status"] == "duplicate" for r in results),
+        "rejected": len(rejected),
+        "results": results,
+    }
+
+
+def _bulk_filter(bulk_filter: TreeBulkFilter):
+    filters = {
+        name: value.astimezone(timezone.utc).replace(tzinfo=None)
+        if isinstance(value, datetime) and value.tzinfo
+        else value
+        for name, value in bulk_filter.dict().items()
+        if value is not None
+    }
+    if not filters:
+        raise HTTPException(status_code=422, detail="The filter matches every tree.")
+    return filters
+
+
+def _bulk_target(ids, bulk_filter: TreeBulkFilter | None, ids_field: str):
+    if (ids is None) == (bulk_filter is None):
+        raise HTTPException(
+            status_code=422, detail=f"Give either '{ids_field}' or 'filter'."
+        )
+    return _bulk_filter(bulk_filter) if bulk_filter is not None else None
+
+
+@router.patch("/trees/bulk")
+async def bulk_update_trees_route(
+    payload: TreeBulkUpdate,
+    request: Request,
+    db: Session = Depends(get_sync_db),
+    token_param: str = Depends(oauth2_scheme),
+):
+    """
+    Change height and diameter of many trees in one transaction: per tree
+    with "trees", or the same "values" for every tree matching "filter".
+    Only the fields given are changed.
+    """
+    await authorize(request, db)
+    filters = _bulk_target(payload.trees, payload.filter, "trees")
+    if filters is None:
+        changes = [change.dict(exclude_unset=True) for change in payload.trees]
+        if any(len(change) == 1 for change in changes):
+            raise HTTPException(status_code=422, detail="No values to set.")
+        updated = await run_db(
+            db, lambda session: bulk_update_trees(session, changes=changes)
+        )
+    else:
+        values = payload.values.dict(exclude_unset=True) if payload.values else {}
+        if not values:
+            raise HTTPException(status_code=422, detail="No values to set.")
+        updated = await run_db(
+            db,
+            lambda session: bulk_update_trees(session, filters=filters, values=values),
+        )
+    return {"updated": updated}
+
+
+@router.delete("/trees/bulk")
+async def bulk_delete_trees_route(
+    payload: TreeBulkDelete,
+    request: Request,
+    db: Session = Depends(get_sync_db),
+    token_param: str = Depends(oauth2_scheme),
+):
+    """Delete the trees in "ids", or every tree matching "filter", in one transaction."""
+    await authorize(request, db)
+    filters = _bulk_target(payload.ids, payload.filter, "ids")
+    deleted = await run_db(
+        db, lambda session: bulk_delete_trees(session, ids=payload.ids, filters=filters)
+    )
+    return {"deleted": deleted}
 
 
 @router.delete("/trees/{tree_id}")
-def delete_tree_route(
+async def delete_tree_route(
     tree_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_db),
     token_param: str = Depends(oauth2_scheme),
 ):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith(BEARER_PREFIX):
-        raise HTTPException(status_code=401, detail=AUTH_ERROR)
-    token = auth_header[len(BEARER_PREFIX):]
-    verify_token(token, db)
-    return delete_tree(tree_id, db)
+    await authorize(request, db)
+    return await run_db(db, lambda session: delete_tree(tree_id, session))
 
 
 @router.put("/trees/{tree_id}")
-def update_tree_route(
+async def update_tree_route(
     tree_id: int,
     tree: TreeUpdate,
     request: Request,
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_db),
     token_param: str = Depends(oauth2_scheme),
 ):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith(BEARER_PREFIX):
-        raise HTTPException(status_code=401, detail=AUTH_ERROR)
-    token = auth_header[len(BEARER_PREFIX):]
-    verify_token(token, db)
-    return update_tree(tree_id, tree.height, tree.diameter, db)
+    await authorize(request, db)
+    return await run_db(
+        db,
+        lambda session: tree_dict(
+            update_tree(tree_id, tree.height, tree.diameter, session)
+        ),
+    )
@@ -1,6 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db
+from database import DbSession, get_db
 from services.user_service import authenticate_user, create_user
 from services.token_service import create_access_token
 from pydantic import BaseModel
@@ -26,16 +25,16 @@ def standard_response(success: bool, message: str, data: dict | None = None):
 
 
 @router.post("/register")
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    return create_user(user.username, user.password, db)
+async def register_user(user: UserCreate, db: DbSession = Depends(get_db)):
+    return await create_user(user.username, user.password, db)
 
 
 @router.post("/login", tags=["Authentication"])
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Other API workers do not see this worker's version bumps, so entries are
+# revalidated against their stamp once they are this old.
+CACHE_TTL_SECONDS = float(os.getenv("TREE_CACHE_TTL_SECONDS", "10"))
+CACHE_MAX_ENTRIES = int(os.getenv("TREE_CACHE_MAX_ENTRIES", "64"))
+
+_lock = threading.Lock()
+_version = 0
+_entries = OrderedDict()
+_in_flight = {}
+
+
+def tree_version():
+    """Version of the tree collection, bumped by every tree mutation."""
+    return _version
+
+
+def bump_tree_version():
+    global _version
+    with _lock:
+        _version += 1
+        _entries.clear()
+
+
+def clear_tree_cache():
+    with _lock:
+        _entries.clear()
+
+
+def _entry(key):
+    """The (entry, fresh) pair for key; entry is None when it is unusable."""
+    entry = _entries.get(key)
+    if entry is None:
+        return None, False
+    version, created, _, _ = entry
+    if version != _version:
+        del _entries[key]
+        return None, False
+    _entries.move_to_end(key)
+    return entry, time.monotonic() - created <= CACHE_TTL_SECONDS
+
+
+async def get_or_load(key, loader, stamp=None):
+    """
+    Return the cached value for key, awaiting loader() on a miss. Concurrent
+    misses for the same key wait for the first caller's load instead of each
+    querying the database.
+
+    stamp, when given, is awaited for a cheap version of the data that every
+    worker sees, such as the change sequence. An entry older than
+    CACHE_TTL_SECONDS is then kept as long as its stamp has not moved, and
+    only reloaded when it has.
+    """
+    while True:
+        with _lock:
+            entry, fresh = _entry(key)
+            if fresh:
+                return entry[3]
+            version = _version
+        in_flight = _in_flight.get(key)
+        if in_flight is None:
+            break
+        try:
+            await asyncio.shield(in_flight)
+        except asyncio.CancelledError:
+            if not in_flight.cancelled():
+                raise
+        except Exception:
+            # The leader's load failed; try again, possibly as the leader.
+            pass
+
+    # Only the event loop thread touches _in_flight, so no lock is needed.
+    in_flight = asyncio.get_running_loop().create_future()
+    _in_flight[key] = in_flight
+    try:
+        # Taken before loading, so the value is at least as new as the stamp.
+        current = await stamp() if stamp is not None else None
+        if entry is not None and stamp is not None and entry[2] == current:
+            value = entry[3]
+        else:
+            value = await loader()
+        with _lock:
+            if version == _version:
+                _entries[key] = (version, time.monotonic(), current, value)
+                while len(_entries) > CACHE_MAX_ENTRIES:
+                    _entries.popitem(last=False)
+        in_flight.set_result(None)
+        return value
+    except asyncio.CancelledError:
+        in_flight.cancel()
+        raise
+    except Exception as e:
+        in_flight.set_exception(e)
+        # Mark it retrieved; waiters only use it as a signal to retry.
+        in_flight.exception()
+        raise
+    finally:
+        del _in_flight[key]
@@ -0,0 +1,68 @@
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+from models.change_sequence_model import ChangeSequence
+from models.tree_model import Tree
+from models.tree_tombstone_model import TreeTombstone
+
+_ID_BATCH = 500
+
+
+def next_change_seq(db: Session):
+    """
+    Take the next change sequence number. The sequence row stays locked
+    until the caller commits, so a higher number never becomes visible
+    before a lower one.
+    """
+    sequence = db.execute(
+        select(ChangeSequence).where(ChangeSequence.id == 1).with_for_update()
+    ).scalar_one_or_none()
+    if sequence is None:
+        sequence = ChangeSequence(id=1, value=0)
+        db.add(sequence)
+    sequence.value += 1
+    db.flush()
+    return sequence.value
+
+
+def current_change_seq(db: Session):
+    """The highest committed change sequence number, 0 when there is none."""
+    value = db.execute(
+        select(ChangeSequence.value).where(ChangeSequence.id == 1)
+    ).scalar_one_or_none()
+    return value or 0
+
+
+def record_tree_changes(db: Session, added=(), removed=(), seq: int | None = None):
+    """
+    Stamp added (inserted or updated) trees with a new change sequence
+    number and leave a tombstone for removed trees that were not re-added.
+    Inserts take seq from next_change_seq beforehand and write it in the
+    INSERT itself; pass it here so those trees are not stamped again.
+    Runs inside the caller's transaction; the caller commits. Returns the
+    sequence number, or None when there was nothing to record.
+    """
+    if not added and not removed and seq is None:
+        return None
+    added_ids = [point.id for point in added]
+    deleted_ids = sorted({point.id for point in removed} - set(added_ids))
+    if seq is None:
+        seq = next_change_seq(db)
+    else:
+        added_ids = []
+
+    for start in range(0, len(added_ids), _ID_BATCH):
+        batch = added_ids[start:start + _ID_BATCH]
+        db.execute(
+            update(Tree)
+            .where(Tree.id.in_(batch))
+            .values(change_seq=seq)
+            .execution_options(synchronize_session=False)
+        )
+    for start in range(0, len(deleted_ids), _ID_BATCH):
+        batch = deleted_ids[start:start + _ID_BATCH]
+        db.execute(delete(TreeTombstone).where(TreeTombstone.tree_id.in_(batch)))
+        db.execute(
+            insert(TreeTombstone),
+            [{"tree_id": tree_id, "change_seq": seq} for tree_id in batch],
+        )
+    return seq
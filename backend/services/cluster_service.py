@@ -0,0 +1,127 @@
+import math
+import os
+from sqlalchemy import bindparam, delete
+from sqlalchemy.orm import Session
+from database import increment_statement
+from models.tree_cluster_model import TreeCluster
+
+CLUSTER_MAX_ZOOM = int(os.getenv("TREE_CLUSTER_MAX_ZOOM", "16"))
+# 2**3 = 8 cells per 256px map tile, so a cluster covers about 32px on screen.
+CLUSTER_CELL_BITS = 3
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def cluster_cell(latitude: float, longitude: float, zoom: int):
+    """Web-mercator (x, y) of the cluster cell containing the point at zoom."""
+    n = 2 ** (zoom + CLUSTER_CELL_BITS)
+    latitude = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, latitude))
+    x = math.floor((longitude + 180) / 360 * n)
+    y = math.floor(
+        (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n
+    )
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _add_point(deltas: dict, point, sign: int):
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        key = (zoom, *cluster_cell(point.latitude, point.longitude, zoom))
+        delta = deltas.setdefault(key, [0, 0.0, 0.0, 0, 0.0, 0, 0.0])
+        delta[0] += sign
+        delta[1] += sign * point.latitude
+        delta[2] += sign * point.longitude
+        if point.height is not None:
+            delta[3] += sign
+            delta[4] += sign * point.height
+        if point.diameter is not None:
+            delta[5] += sign
+            delta[6] += sign * point.diameter
+
+
+KEY_COLUMNS = ("zoom", "cell_x", "cell_y")
+TOTALS = (
+    "count",
+    "latitude_sum",
+    "longitude_sum",
+    "height_count",
+    "height_sum",
+    "diameter_count",
+    "diameter_sum",
+)
+
+
+def apply_cluster_changes(db: Session, added=(), removed=()):
+    """
+    Fold added and removed TreePoints into the cluster totals of every zoom
+    level. Runs inside the caller's transaction; the caller commits.
+    """
+    deltas = {}
+    for point in added:
+        _add_point(deltas, point, 1)
+    for point in removed:
+        _add_point(deltas, point, -1)
+    if not deltas:
+        return
+
+    # The database adds the deltas to the stored totals, so nothing has to be
+    # read or locked first; cells a removal emptied are deleted afterwards.
+    rows = [
+        {"zoom": zoom, "cell_x": x, "cell_y": y, **dict(zip(TOTALS, delta))}
+        for (zoom, x, y), delta in deltas.items()
+    ]
+    table = TreeCluster.__table__
+    db.execute(increment_statement(db, table, KEY_COLUMNS, TOTALS), rows)
+    emptied = [
+        {"zoom": zoom, "cell_x": x, "cell_y": y}
+        for (zoom, x, y), delta in deltas.items()
+        if delta[0] <= 0
+    ]
+    if emptied:
+        columns = table.c
+        db.execute(
+            delete(table).where(
+                columns.zoom == bindparam("zoom"),
+                columns.cell_x == bindparam("cell_x"),
+                columns.cell_y == bindparam("cell_y"),
+                columns.count <= 0,
+            ),
+            emptied,
+        )
+
+
+def get_clusters(db: Session, zoom: int, bbox: dict):
+    """Clusters at zoom (clamped to CLUSTER_MAX_ZOOM) inside the bounding box."""
+    zoom = min(zoom, CLUSTER_MAX_ZOOM)
+    query = db.query(TreeCluster).filter(TreeCluster.zoom == zoom)
+    if bbox.get("min_lon") is not None:
+        query = query.filter(TreeCluster.cell_x >= cluster_cell(0, bbox["min_lon"], zoom)[0])
+    if bbox.get("max_lon") is not None:
+        query = query.filter(TreeCluster.cell_x <= cluster_cell(0, bbox["max_lon"], zoom)[0])
+    # Mercator y grows southwards.
+    if bbox.get("max_lat") is not None:
+        query = query.filter(TreeCluster.cell_y >= cluster_cell(bbox["max_lat"], 0, zoom)[1])
+    if bbox.get("min_lat") is not None:
+        query = query.filter(TreeCluster.cell_y <= cluster_cell(bbox["min_lat"], 0, zoom)[1])
+    return [
+        {
+            "latitude": cluster.latitude_sum / cluster.count,
+            "longitude": cluster.longitude_sum / cluster.count,
+            "count": cluster.count,
+            "average_height": (
+                cluster.height_sum / cluster.height_count if cluster.height_count else None
+            ),
+            "average_diameter": (
+                cluster.diameter_sum / cluster.diameter_count
+                if cluster.diameter_count
+                else None
+            ),
+        }
+        for cluster in query.order_by(TreeCluster.cell_x, TreeCluster.cell_y)
+    ]
+
+
+def rebuild_clusters(db: Session, points):
+    """Recompute every cluster from an iterable of TreePoint batches."""
+    db.execute(delete(TreeCluster))
+    for batch in points:
+        apply_cluster_changes(db, added=batch)
+    db.commit()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import threading
+
+# Events a slow subscriber may have queued before it is dropped; it has to
+# catch up through GET /trees/changes.
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("TREE_EVENTS_QUEUE_SIZE", "100"))
+
+logger = logging.getLogger(__name__)
+
+
+def tree_changes_event(seq: int, added=(), removed=()):
+    """
+    A compact event for one committed transaction: upserted trees with their
+    position and measurements, and deleted trees with their last position.
+    """
+    added_ids = {point.id for point in added}
+    changes = [
+        {
+            "op": "upsert",
+            "id": point.id,
+            "lat": point.latitude,
+            "lon": point.longitude,
+            "height": point.height,
+            "diameter": point.diameter,
+        }
+        for point in added
+    ]
+    changes += [
+        {"op": "delete", "id": point.id, "lat": point.latitude, "lon": point.longitude}
+        for point in removed
+        if point.id not in added_ids
+    ]
+    return {"seq": seq, "changes": changes}
+
+
+def _in_bbox(change: dict, bbox: dict):
+    return (
+        bbox.get("min_lat", -90) <= change["lat"] <= bbox.get("max_lat", 90)
+        and bbox.get("min_lon", -180) <= change["lon"] <= bbox.get("max_lon", 180)
+    )
+
+
+def filter_event(event: dict, bbox: dict | None):
+    """The event limited to changes inside bbox, or None if nothing is left."""
+    if not bbox:
+        return event
+    changes = [change for change in event["changes"] if _in_bbox(change, bbox)]
+    if not changes:
+        return None
+    return {**event, "changes": changes}
+
+
+class Subscription:
+    """The event queue of one subscriber, read from its event loop."""
+
+    def __init__(self, bbox: dict | None, loop: asyncio.AbstractEventLoop):
+        self.bbox = bbox
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def _offer(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Wake the reader so it can close the stream.
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """The next event, or None once the subscriber has fallen behind."""
+        event = await self.queue.get()
+        if self.overflowed:
+            return None
+        return event
+
+
+class TreeEventHub:
+    """
+    Fans tree change events out to subscribers. This implementation only
+    reaches subscribers of the same process; a broker-backed hub (Redis
+    pub/sub, Cloud Pub/Sub) implements the same three methods and is
+    installed with set_hub.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, bbox: dict | None = None):
+        subscription = Subscription(bbox, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: dict):
+        """Deliver event to every matching subscriber. Safe from any thread."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.overflowed:
+                # Its stream has ended, or never started reading.
+                self.unsubscribe(subscription)
+                continue
+            filtered = filter_event(event, subscription.bbox)
+            if filtered is None:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, filtered)
+            except RuntimeError:
+                # The subscriber's event loop has closed.
+                self.unsubscribe(subscription)
+
+
+_hub = TreeEventHub()
+
+
+def get_hub():
+    return _hub
+
+
+def set_hub(hub):
+    global _hub
+    _hub = hub
+
+
+def publish_tree_changes(seq: int, added=(), removed=()):
+    event = tree_changes_event(seq, added, removed)
+    if not event["changes"]:
+        return
+    try:
+        _hub.publish(event)
+    except Exception:
+        # A broken push channel must never fail a committed mutation.
+        logger.exception("Could not publish tree changes.")
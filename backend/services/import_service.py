@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import anyio
+import ijson
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models.import_job_model import ImportJob
+from services.tree_service import BULK_CHUNK_SIZE, bulk_create_trees, tree_from_feature
+
+# Uploads wait here until a worker has imported them. Jobs left queued or
+# running by a worker that stopped are not resumed; upload the file again.
+#
+# On Cloud Run the local filesystem, /tmp included, is held in memory, so an
+# upload there counts against the instance's memory. Mount a disk-backed
+# volume (Cloud Storage or NFS) and point IMPORT_DIR at it; without it imports
+# are refused there. Imports run after the 202 has been sent, so the service
+# also needs CPU outside requests (`--no-cpu-throttling`, set by the CD
+# workflows), or Cloud Run throttles the workers to a crawl.
+IMPORT_DIR = os.getenv("IMPORT_DIR")
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+ERROR_SAMPLE_LIMIT = 20
+ON_CLOUD_RUN = "K_SERVICE" in os.environ
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=IMPORT_WORKERS, thread_name_prefix="tree-import"
+            )
+        return _executor
+
+
+def stop_import_workers(wait: bool = False):
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def import_dir():
+    """Where uploads are kept, or None when imports are not possible here."""
+    if IMPORT_DIR:
+        return IMPORT_DIR
+    if ON_CLOUD_RUN:
+        return None
+    return os.path.join(tempfile.gettempdir(), "tree-imports")
+
+
+def new_import_id():
+    return uuid.uuid4().hex
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def save_upload(chunks, job_id: str):
+    """
+    Write an upload, an async iterable of byte chunks, to the import
+    directory as it arrives. The partial file is removed when it fails.
+    """
+    directory = import_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{job_id}.geojson")
+    try:
+        async with await anyio.open_file(path, "wb") as target:
+            async for chunk in chunks:
+                await target.write(chunk)
+    except BaseException:
+        _remove(path)
+        raise
+    return path
+
+
+def discard_upload(path: str):
+    _remove(path)
+
+
+def create_import_job(db: Session, job_id: str, filename: str | None):
+    job = ImportJob(
+        id=job_id,
+        status="queued",
+        filename=filename[:255] if filename else None,
+        processed=0,
+        inserted=0,
+        duplicates=0,
+        errors=0,
+    )
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+def queue_import(job_id: str, path: str):
+    _get_executor().submit(run_import, job_id, path)
+
+
+def iter_features(file):
+    """
+    The features of a GeoJSON FeatureCollection, parsed incrementally.
+    Raises ValueError once the file turns out not to be one.
+    """
+    seen = {"type": None, "features": False}
+
+    def events():
+        for prefix, event, value in ijson.parse(file, use_float=True):
+            if prefix == "type" and event == "string":
+                seen["type"] = value
+            elif prefix == "features" and event == "start_array":
+                seen["features"] = True
+            yield prefix, event, value
+
+    yield from ijson.items(events(), "features.item")
+    if seen["type"] != "FeatureCollection" or not seen["features"]:
+        raise ValueError("Not a GeoJSON FeatureCollection with a 'features' array.")
+
+
+def _import_chunk(db: Session, job: ImportJob, chunk: list):
+    results = bulk_create_trees(chunk, db)
+    job.processed += len(chunk)
+    job.inserted += sum(r["status"] == "inserted" for r in results.values())
+    job.duplicates += sum(r["status"] == "duplicate" for r in results.values())
+    db.commit()
+
+
+def run_import(job_id: str, path: str):
+    """
+    Import the features in path into job_id, BULK_CHUNK_SIZE at a time with
+    the duplicate semantics of create_tree, committing progress per chunk.
+    """
+    db = SessionLocal()
+    samples = []
+    job = None
+    try:
+        job = db.get(ImportJob, job_id)
+        job.status = "running"
+        job.started_at = _now()
+        db.commit()
+
+        chunk = []
+        with open(path, "rb") as file:
+            for index, feature in enumerate(iter_features(file)):
+                try:
+                    chunk.append((index, tree_from_feature(feature)))
+                except ValueError as e:
+                    job.processed += 1
+                    job.errors += 1
+                    if len(samples) < ERROR_SAMPLE_LIMIT:
+                        samples.append({"index": index, "detail": str(e)})
+                    continue
+                if len(chunk) == BULK_CHUNK_SIZE:
+                    _import_chunk(db, job, chunk)
+                    chunk = []
+        if chunk:
+            _import_chunk(db, job, chunk)
+        job.status = "done"
+    except Exception as e:
+        db.rollback()
+        if isinstance(e, (ijson.JSONError, ValueError, OSError)):
+            detail = f"Could not read the file: {e}"
+        else:
+            logger.exception("Import %s failed.", job_id)
+            detail = "The import failed."
+        samples.append({"index": None, "detail": detail})
+        job = db.get(ImportJob, job_id)
+        if job is not None:
+            job.status = "failed"
+    finally:
+        if job is not None:
+            job.finished_at = _now()
+            job.error_samples = json.dumps(samples)
+            db.commit()
+        db.close()
+        _remove(path)
+
+
+def get_import_job(db: Session, job_id: str):
+    return db.get(ImportJob, job_id)
+
+
+def import_job_dict(job: ImportJob):
+    end = job.finished_at or _now()
+    seconds = (end - job.started_at).total_seconds() if job.started_at else None
+    return {
+        "id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "processed": job.processed,
+        "inserted": job.inserted,
+        "duplicates": job.duplicates,
+        "errors": job.errors,
+        "error_samples": json.loads(job.error_samples) if job.error_samples else [],
+        "rows_per_second": round(job.processed / seconds, 1) if seconds else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
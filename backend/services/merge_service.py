@@ -0,0 +1,185 @@
+"""
+Offline merge of near-duplicate trees left behind by repeated surveys.
+
+create_tree only compares a new tree with the rows that already exist, so two
+surveys of the same street leave pairs or clusters of trees a few metres
+apart. This job sweeps the whole table in latitude order, in batches of
+bounded size, and bins each batch into a hash grid whose cells are as large as
+the merge radius. A tree is then only compared with the trees in its own and
+the neighbouring cells, which keeps the sweep linear in the number of trees.
+
+Groups are formed around a seed: the first unmerged tree in sweep order takes
+every unmerged tree within the radius. Unlike a transitive closure this never
+chains a row of street trees planted a few metres apart into one group.
+
+The job runs in its own process (`python manage.py merge-duplicates`), so the
+in-process side of a mutation does not reach the API workers. No Server-Sent
+Events are pushed for merges; clients pick them up from GET /trees/changes,
+where they are recorded as upserts of the kept trees and deletes of the rest.
+The workers' response caches revalidate against the change sequence within
+TREE_CACHE_TTL_SECONDS, and their nearest-tree index serves merged-away trees
+until its next reload, TREE_NEAREST_RELOAD_SECONDS.
+"""
+import math
+import os
+import statistics
+from sqlalchemy import Float, and_, or_, select, type_coerce
+from sqlalchemy.orm import Session
+from models.tree_model import Tree
+from services.spatial_service import (
+    EARTH_RADIUS_M,
+    TreePoint,
+    grid_cell,
+    haversine_m,
+    neighbour_cells,
+)
+from services.tree_service import DUPLICATE_RADIUS_M, merge_tree_groups
+
+MERGE_RADIUS_M = float(os.getenv("TREE_MERGE_RADIUS_M", str(DUPLICATE_RADIUS_M)))
+MERGE_BATCH_SIZE = int(os.getenv("TREE_MERGE_BATCH_SIZE", "10000"))
+MERGE_METHODS = {"mean": statistics.fmean, "median": statistics.median}
+
+
+def combine_points(points: list, method: str = "median"):
+    """
+    Merged coordinates and measurements of a group of TreePoints. Missing
+    heights and diameters are ignored; None when no tree has one.
+    """
+    average = MERGE_METHODS[method]
+
+    def merged(name):
+        values = [
+            getattr(point, name) for point in points if getattr(point, name) is not None
+        ]
+        return average(values) if values else None
+
+    return {name: merged(name) for name in ("latitude", "longitude", "height", "diameter")}
+
+
+def _sweep_batches(db: Session, batch_size: int):
+    """
+    Yield every tree as lists of TreePoints in (latitude, id) order, with
+    whether it is the last batch. The last batch may be empty.
+    """
+    # Compare and return the latitude as a float: the Numeric result is
+    # rounded, which on SQLite no longer equals the stored value and would
+    # repeat rows at a batch boundary.
+    latitude = type_coerce(Tree.latitude, Float)
+    query = select(
+        Tree.id, latitude.label("latitude"), Tree.longitude, Tree.height, Tree.diameter
+    ).order_by(latitude, Tree.id).limit(batch_size)
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = query.where(
+                latitude >= last.latitude,
+                or_(
+                    latitude > last.latitude,
+                    and_(latitude == last.latitude, Tree.id > last.id),
+                ),
+            )
+        rows = db.execute(page).all()
+        done = len(rows) < batch_size
+        yield [TreePoint.from_row(row) for row in rows], done
+        if done:
+            return
+        last = rows[-1]
+
+
+def _group_points(points: list, horizon: float, radius_m: float):
+    """
+    Seed groups among points, which are in latitude order. Trees from
+    horizon northwards may still have partners in the next batch, so they do
+    not seed a group here; the ones left unmerged are carried over.
+    """
+    cells = {}
+    for point in points:
+        key = grid_cell(point.latitude, point.longitude, radius_m)
+        cells.setdefault(key, []).append(point)
+    taken = set()
+    groups = []
+    carried = []
+    for seed in points:
+        if seed.id in taken:
+            continue
+        if seed.latitude >= horizon:
+            carried.append(seed)
+            continue
+        taken.add(seed.id)
+        group = [seed]
+        for key in neighbour_cells(seed.latitude, seed.longitude, radius_m, radius_m):
+            for other in cells.get(key, ()):
+                if other.id not in taken and haversine_m(
+                    seed.latitude, seed.longitude, other.latitude, other.longitude
+                ) <= radius_m:
+                    taken.add(other.id)
+                    group.append(other)
+        if len(group) > 1:
+            groups.append(group)
+    # A seed can take a tree that was carried before it was reached.
+    return groups, [point for point in carried if point.id not in taken]
+
+
+def find_duplicate_groups(
+    db: Session, radius_m: float = MERGE_RADIUS_M, batch_size: int = MERGE_BATCH_SIZE
+):
+    """
+    Yield (groups, scanned) per batch: the groups of TreePoints within
+    radius_m of their seed found in it and the number of trees read. At most
+    batch_size trees plus the carried band of radius_m are held at a time.
+    """
+    # Degrees of latitude spanned by radius_m as haversine_m measures it.
+    radius_deg = math.degrees(radius_m / EARTH_RADIUS_M)
+    carried = []
+    for batch, last in _sweep_batches(db, batch_size):
+        horizon = float("inf") if last else batch[-1].latitude - radius_deg
+        groups, carried = _group_points(carried + batch, horizon, radius_m)
+        yield groups, len(batch)
+
+
+def merge_duplicates(
+    db: Session,
+    radius_m: float = MERGE_RADIUS_M,
+    method: str = "median",
+    batch_size: int = MERGE_BATCH_SIZE,
+    dry_run: bool = False,
+    report=None,
+):
+    """
+    Merge every group of near-duplicate trees into its oldest tree, which
+    gets the mean or median coordinates and measurements of the group. Each
+    batch is merged and committed on its own. With dry_run nothing is
+    written. report, when given, is called with a dict per group. Returns
+    totals of the run.
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"Unknown merge method {method!r}.")
+    totals = {"scanned": 0, "groups": 0, "merged": 0, "dry_run": dry_run}
+    for groups, scanned in find_duplicate_groups(db, radius_m, batch_size):
+        totals["scanned"] += scanned
+        results = []
+        if dry_run:
+            for points in groups:
+                points = sorted(points, key=lambda point: point.id)
+                kept = points[0]._replace(**combine_points(points, method))
+                results.append((kept, [point.id for point in points[1:]]))
+        elif groups:
+            results = merge_tree_groups(
+                db,
+                [[point.id for point in points] for points in groups],
+                lambda points: combine_points(points, method),
+            )
+        for kept, merged_ids in results:
+            totals["groups"] += 1
+            totals["merged"] += len(merged_ids)
+            if report:
+                report({
+                    "id": kept.id,
+                    "merged_ids": merged_ids,
+                    "latitude": kept.latitude,
+                    "longitude": kept.longitude,
+                    "height": kept.height,
+                    "diameter": kept.diameter,
+                })
+    return totals
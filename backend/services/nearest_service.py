@@ -0,0 +1,283 @@
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models.tree_model import Tree
+from services.spatial_service import (
+    TreePoint,
+    cell_col,
+    cell_key,
+    cell_row,
+    grid_cell,
+    haversine_m,
+)
+
+NEAREST_CELL_M = float(os.getenv("TREE_NEAREST_CELL_M", "50"))
+# Searches that find too few trees within this distance on the fine grid go
+# on over blocks of this size, so an empty area costs few lookups.
+NEAREST_BLOCK_M = float(os.getenv("TREE_NEAREST_BLOCK_M", "800"))
+# Mutations made by other API workers only show up after a reload.
+NEAREST_RELOAD_SECONDS = float(os.getenv("TREE_NEAREST_RELOAD_SECONDS", "300"))
+# Trees further away are never returned, so a query far from the inventory
+# costs a bounded number of rings instead of a scan over every tree.
+NEAREST_MAX_DISTANCE_M = float(os.getenv("TREE_NEAREST_MAX_DISTANCE_M", "10000"))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# Notified whenever a load finishes, for requests waiting on the first one.
+_load_done = threading.Condition(_lock)
+_index = None
+_loaded_at = 0.0
+# Changes applied while a reload reads the table, replayed onto its result.
+_changes_during_load = None
+_stop = threading.Event()
+_thread = None
+
+
+class _GridIndex:
+    """
+    Trees binned into NEAREST_CELL_M cells, plus per NEAREST_BLOCK_M block
+    the number of its trees in each occupied cell. The two grids are not
+    aligned; a block lists every cell holding at least one of its trees.
+    """
+
+    def __init__(self):
+        self.cells = {}
+        self.cell_of = {}
+        self.blocks = {}
+
+    def add(self, point: TreePoint):
+        self.remove(point.id)
+        key = grid_cell(point.latitude, point.longitude, NEAREST_CELL_M)
+        self.cells.setdefault(key, {})[point.id] = point
+        self.cell_of[point.id] = key
+        block = self.blocks.setdefault(
+            grid_cell(point.latitude, point.longitude, NEAREST_BLOCK_M), {}
+        )
+        block[key] = block.get(key, 0) + 1
+
+    def remove(self, tree_id: int):
+        key = self.cell_of.pop(tree_id, None)
+        if key is None:
+            return
+        cell = self.cells[key]
+        point = cell.pop(tree_id)
+        if not cell:
+            del self.cells[key]
+        block_key = grid_cell(point.latitude, point.longitude, NEAREST_BLOCK_M)
+        block = self.blocks[block_key]
+        block[key] -= 1
+        if not block[key]:
+            del block[key]
+            if not block:
+                del self.blocks[block_key]
+
+    def apply(self, added, removed):
+        for point in removed:
+            self.remove(point.id)
+        for point in added:
+            self.add(point)
+
+
+def reset_nearest_index():
+    global _index, _loaded_at
+    with _lock:
+        _index = None
+        _loaded_at = 0.0
+
+
+def _build(db: Session):
+    index = _GridIndex()
+    rows = db.execute(
+        select(Tree.id, Tree.latitude, Tree.longitude, Tree.height, Tree.diameter)
+        .execution_options(yield_per=10000)
+    )
+    for row in rows:
+        index.add(TreePoint.from_row(row))
+    return index
+
+
+def load_nearest_index(db: Session):
+    """
+    Rebuild the index from the trees table. Queries keep using the old index
+    meanwhile; mutations committed during the rebuild are replayed onto it.
+    """
+    global _index, _loaded_at, _changes_during_load
+    with _lock:
+        if _changes_during_load is not None:
+            # Another thread is already loading.
+            return
+        _changes_during_load = []
+    try:
+        index = _build(db)
+        with _lock:
+            for added, removed in _changes_during_load:
+                index.apply(added, removed)
+            _index = index
+            _loaded_at = time.monotonic()
+    finally:
+        with _lock:
+            _changes_during_load = None
+            _load_done.notify_all()
+
+
+def _ensure_loaded(db: Session):
+    # Only the first load happens in a request; start_nearest_sync reloads.
+    # Concurrent first requests wait for the one load instead of searching a
+    # missing index; if that load fails, the next waiter tries again.
+    while True:
+        with _lock:
+            while _index is None and _changes_during_load is not None:
+                _load_done.wait()
+            if _index is not None:
+                return
+        load_nearest_index(db)
+
+
+def _reload():
+    db = SessionLocal()
+    try:
+        load_nearest_index(db)
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("Could not reload the nearest-tree index.")
+    finally:
+        db.close()
+
+
+def _reload_loop():
+    while not _stop.wait(NEAREST_RELOAD_SECONDS):
+        # Nothing to refresh until a request has needed the index.
+        if _index is not None:
+            _reload()
+
+
+def start_nearest_sync():
+    """Reload the index every NEAREST_RELOAD_SECONDS in a daemon thread."""
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_reload_loop, name="nearest-sync", daemon=True)
+        _thread.start()
+
+
+def stop_nearest_sync():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
+
+
+def apply_nearest_changes(added=(), removed=()):
+    """Update the in-memory index after a committed tree mutation."""
+    with _lock:
+        if _changes_during_load is not None:
+            _changes_during_load.append((list(added), list(removed)))
+        if _index is not None:
+            _index.apply(added, removed)
+
+
+def _ring(row: int, lon: float, ring: int, cell_m: float):
+    for r in range(row - ring, row + ring + 1):
+        if r < 0:
+            continue
+        col = cell_col(r, lon, cell_m)
+        if abs(r - row) == ring:
+            cols = range(col - ring, col + ring + 1)
+        else:
+            cols = (col - ring, col + ring)
+        for c in cols:
+            if c >= 0:
+                yield cell_key(r, c)
+
+
+def _walk(latitude, longitude, cell_m, scan, done, limit_m):
+    """
+    Call scan with the keys of each ring of cell_m cells around the point
+    until done(reach) holds, reach being the distance every unvisited cell
+    is at least away, or reach passes limit_m. Returns whether done held.
+    """
+    row = cell_row(latitude, cell_m)
+    ring = 0
+    while True:
+        # Rings 0..ring-1 are done; any cell further out is at least this
+        # far from the point, wherever it lies inside its own cell.
+        reach = (ring - 1) * cell_m * 0.99
+        if done(reach):
+            return True
+        if reach > limit_m:
+            return False
+        keys = list(_ring(row, longitude, ring, cell_m))
+        # Locked per ring, so mutations are not held up by a long search.
+        with _lock:
+            scan(keys)
+        ring += 1
+
+
+def nearest_trees(
+    db: Session,
+    latitude: float,
+    longitude: float,
+    k: int,
+    max_distance_m: float | None = None,
+):
+    """
+    The k trees closest to the point, nearest first, as (distance_m,
+    TreePoint) pairs. Only trees within max_distance_m, at most
+    NEAREST_MAX_DISTANCE_M, are considered, so fewer than k may be returned.
+
+    The fine grid is searched ring by ring until no unvisited cell can hold
+    a closer tree. When that is not settled within NEAREST_BLOCK_M, the
+    search goes on over blocks and scans the occupied cells of each. The
+    worst case, an empty area, costs about (2 * NEAREST_BLOCK_M /
+    NEAREST_CELL_M)^2 cell lookups plus (2 * NEAREST_MAX_DISTANCE_M /
+    NEAREST_BLOCK_M)^2 block lookups: some 1400 and 900 by default.
+    """
+    _ensure_loaded(db)
+    if max_distance_m is None or max_distance_m > NEAREST_MAX_DISTANCE_M:
+        max_distance_m = NEAREST_MAX_DISTANCE_M
+    index = _index
+    best = []
+    seen = set()
+
+    def done(reach):
+        return reach > max_distance_m or (len(best) == k and -best[0][0] <= reach)
+
+    def scan_cell(key):
+        if key in seen:
+            return
+        seen.add(key)
+        for point in index.cells.get(key, {}).values():
+            _offer(best, k, latitude, longitude, point, max_distance_m)
+
+    def scan_cells(keys):
+        for key in keys:
+            scan_cell(key)
+
+    def scan_blocks(keys):
+        for key in keys:
+            for cell in index.blocks.get(key, ()):
+                scan_cell(cell)
+
+    if not _walk(latitude, longitude, NEAREST_CELL_M, scan_cells, done, NEAREST_BLOCK_M):
+        _walk(latitude, longitude, NEAREST_BLOCK_M, scan_blocks, done, math.inf)
+    return sorted(((-d, point) for d, _, point in best), key=lambda pair: pair[0])
+
+
+def _offer(best: list, k: int, latitude: float, longitude: float, point, max_distance_m):
+    distance = haversine_m(latitude, longitude, point.latitude, point.longitude)
+    if max_distance_m is not None and distance > max_distance_m:
+        return
+    entry = (-distance, point.id, point)
+    if len(best) < k:
+        heapq.heappush(best, entry)
+    elif distance < -best[0][0]:
+        heapq.heapreplace(best, entry)
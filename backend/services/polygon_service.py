@@ -0,0 +1,131 @@
+"""
+Trees inside a GeoJSON Polygon or MultiPolygon.
+
+Like every geometry in this project, polygon positions are [latitude,
+longitude]. Candidates come from the bounding box of the polygon, which the
+latitude/longitude index serves, and are then tested with numpy.
+"""
+import numpy as np
+from sqlalchemy import Float, select, type_coerce
+from sqlalchemy.orm import Session
+from models.tree_model import Tree
+
+POLYGON_TYPES = ("Polygon", "MultiPolygon")
+MAX_POLYGON_POSITIONS = 50_000
+
+# Read the Numeric coordinates as floats; building Decimals is most of the
+# cost of fetching a city's worth of candidates.
+_POINT_COLUMNS = (
+    Tree.id,
+    type_coerce(Tree.latitude, Float).label("latitude"),
+    type_coerce(Tree.longitude, Float).label("longitude"),
+)
+
+
+def _ring(positions):
+    if not isinstance(positions, list) or len(positions) < 4:
+        raise ValueError("A ring needs at least four positions.")
+    for position in positions:
+        if (
+            not isinstance(position, list)
+            or len(position) < 2
+            or not all(
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                for value in position[:2]
+            )
+        ):
+            raise ValueError("Positions must be [latitude, longitude] numbers.")
+    ring = np.array([position[:2] for position in positions], dtype=float)
+    if not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    return ring
+
+
+def parse_polygons(geometry: dict):
+    """
+    The polygons of a Polygon or MultiPolygon geometry, or of a Feature with
+    one, each as a list of closed (n, 2) rings. Raises ValueError when unusable.
+    """
+    if isinstance(geometry, dict) and geometry.get("type") == "Feature":
+        geometry = geometry.get("geometry")
+    if not isinstance(geometry, dict) or geometry.get("type") not in POLYGON_TYPES:
+        raise ValueError("Expected a GeoJSON 'Polygon' or 'MultiPolygon'.")
+    coordinates = geometry.get("coordinates")
+    if geometry["type"] == "Polygon":
+        coordinates = [coordinates]
+    if not isinstance(coordinates, list) or not coordinates:
+        raise ValueError("The geometry has no coordinates.")
+    polygons = []
+    for polygon in coordinates:
+        if not isinstance(polygon, list) or not polygon:
+            raise ValueError("A polygon needs at least one ring.")
+        polygons.append([_ring(ring) for ring in polygon])
+    if sum(len(ring) for polygon in polygons for ring in polygon) > MAX_POLYGON_POSITIONS:
+        raise ValueError("The geometry has too many positions.")
+    return polygons
+
+
+def polygons_bbox(polygons: list):
+    """(min_lat, min_lon, max_lat, max_lon) of the outer rings."""
+    outer = np.vstack([polygon[0] for polygon in polygons])
+    min_lat, min_lon = outer.min(axis=0)
+    max_lat, max_lon = outer.max(axis=0)
+    return float(min_lat), float(min_lon), float(max_lat), float(max_lon)
+
+
+def points_in_polygons(latitudes, longitudes, polygons: list):
+    """
+    Boolean mask of the points inside any of the polygons. Even-odd rule over
+    the rings of a polygon, so holes are excluded.
+
+    Points are sorted by latitude once; each edge then only looks at the
+    points in its own latitude band, so the cost grows with the number of
+    points times the edges a parallel crosses, not times all edges.
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    order = np.argsort(latitudes, kind="stable")
+    sorted_lat = latitudes[order]
+    sorted_lon = longitudes[order]
+
+    inside = np.zeros(len(latitudes), dtype=bool)
+    for polygon in polygons:
+        odd = np.zeros(len(latitudes), dtype=bool)
+        for ring in polygon:
+            lat0, lon0 = ring[:-1, 0], ring[:-1, 1]
+            lat1, lon1 = ring[1:, 0], ring[1:, 1]
+            # A point crosses an edge when low <= latitude < high.
+            starts = np.searchsorted(sorted_lat, np.minimum(lat0, lat1), side="left")
+            ends = np.searchsorted(sorted_lat, np.maximum(lat0, lat1), side="left")
+            for i in np.flatnonzero(ends > starts):
+                band = slice(starts[i], ends[i])
+                crossing_lon = lon0[i] + (sorted_lat[band] - lat0[i]) * (
+                    (lon1[i] - lon0[i]) / (lat1[i] - lat0[i])
+                )
+                odd[band] ^= sorted_lon[band] < crossing_lon
+        inside |= odd
+    mask = np.empty(len(latitudes), dtype=bool)
+    mask[order] = inside
+    return mask
+
+
+def trees_within(db: Session, polygons: list, columns=None):
+    """
+    Rows of the trees inside polygons, ordered by id. columns defaults to
+    id, latitude and longitude; pass TREE_COLUMNS for full trees.
+    """
+    columns = columns or _POINT_COLUMNS
+    min_lat, min_lon, max_lat, max_lon = polygons_bbox(polygons)
+    # No ORDER BY, so the planner is free to range-scan the coordinate index.
+    rows = db.execute(
+        select(*columns).where(
+            Tree.latitude >= min_lat,
+            Tree.latitude <= max_lat,
+            Tree.longitude >= min_lon,
+            Tree.longitude <= max_lon,
+        )
+    ).all()
+    latitudes = np.fromiter((float(row.latitude) for row in rows), float, len(rows))
+    longitudes = np.fromiter((float(row.longitude) for row in rows), float, len(rows))
+    mask = points_in_polygons(latitudes, longitudes, polygons)
+    return sorted((row for row, hit in zip(rows, mask) if hit), key=lambda row: row.id)
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
+from models.revoked_token_model import RevokedToken
+
+# How often every worker re-reads revoked_tokens to pick up revocations made
+# by other workers.
+RECONCILE_SECONDS = float(os.getenv("REVOCATION_RECONCILE_SECONDS", "30"))
+SWEEP_SECONDS = float(os.getenv("REVOCATION_SWEEP_SECONDS", "3600"))
+SWEEP_BATCH_SIZE = int(os.getenv("REVOCATION_SWEEP_BATCH_SIZE", "500"))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_revoked = None
+# Digests revoked by this worker while a reload was reading the table.
+_added_during_load = None
+_stop = threading.Event()
+_thread = None
+
+
+def token_digest(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def load_revocations(db):
+    """Replace the in-process revocation set with the contents of the table."""
+    global _revoked, _added_during_load
+    with _lock:
+        _added_during_load = set()
+    try:
+        revoked = set(db.execute(select(RevokedToken.token_hash)).scalars())
+        with _lock:
+            _revoked = revoked | _added_during_load
+    finally:
+        with _lock:
+            _added_during_load = None
+
+
+def purge_expired_revocations(db, batch_size: int = SWEEP_BATCH_SIZE):
+    """
+    Delete revocations whose token has expired, batch_size rows per
+    transaction so no statement holds locks for long. Returns the number of
+    rows deleted.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    deleted = 0
+    while True:
+        ids = (
+            db.execute(
+                select(RevokedToken.id)
+                .where(RevokedToken.expires_at < now)
+                .order_by(RevokedToken.id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            return deleted
+        db.execute(delete(RevokedToken).where(RevokedToken.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+
+
+def is_revoked(token: str):
+    """
+    True or False from the in-process set, or None when it has not been
+    loaded and the caller has to ask the database.
+    """
+    revoked = _revoked
+    if revoked is None:
+        return None
+    return token_digest(token) in revoked
+
+
+def add_revocation(token: str):
+    digest = token_digest(token)
+    with _lock:
+        if _revoked is not None:
+            _revoked.add(digest)
+        if _added_during_load is not None:
+            _added_during_load.add(digest)
+
+
+def reset_revocations():
+    global _revoked
+    with _lock:
+        _revoked = None
+
+
+def _reconcile(sweep: bool = False):
+    db = SessionLocal()
+    try:
+        if sweep:
+            deleted = purge_expired_revocations(db)
+            if deleted:
+                logger.info("Swept %d expired revoked tokens.", deleted)
+        load_revocations(db)
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("Could not sync revoked tokens.")
+    finally:
+        db.close()
+
+
+def _reconcile_loop():
+    last_sweep = time.monotonic()
+    while not _stop.wait(RECONCILE_SECONDS):
+        sweep = time.monotonic() - last_sweep >= SWEEP_SECONDS
+        if sweep:
+            last_sweep = time.monotonic()
+        _reconcile(sweep)
+
+
+def start_revocation_sync():
+    """
+    Load the revocation set and keep reconciling it, and sweeping expired
+    rows, in a daemon thread.
+    """
+    global _thread
+    _reconcile()
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(
+            target=_reconcile_loop, name="revocation-sync", daemon=True
+        )
+        _thread.start()
+
+
+def stop_revocation_sync():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
@@ -0,0 +1,134 @@
+"""
+Compact binary snapshot of every tree for the mobile map.
+
+A snapshot is a MessagePack map:
+
+    {
+        "format": 1,             # SNAPSHOT_FORMAT
+        "count": n,              # number of trees
+        "scale": 1000000,        # coordinate units per degree (micro-degrees)
+        "id": bin,               # packed columns, see below
+        "latitude": bin,
+        "longitude": bin,
+        "height_cm": bin,
+        "diameter_mm": bin,
+    }
+
+Every column is n zigzag-encoded LEB128 varints. id, latitude and longitude
+hold the difference to the previous tree (the first against 0), latitude
+and longitude in integer micro-degrees. height_cm and diameter_mm hold the
+value plus one, with 0 for a tree without a measurement.
+
+Trees are ordered by 0.01-degree latitude band and then by longitude, so
+consecutive coordinates, and so their deltas, are small.
+"""
+import msgpack
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models.tree_model import Tree
+from services.spatial_service import TreePoint
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_MEDIA_TYPE = "application/x-msgpack"
+COORDINATE_SCALE = 1_000_000
+BAND_DEGREES = 0.01
+COLUMNS = ("id", "latitude", "longitude", "height_cm", "diameter_mm")
+
+
+def _write_varint(out: bytearray, value: int):
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data: bytes, count: int):
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value = shift = 0
+    if len(values) != count or shift:
+        raise ValueError("Truncated snapshot column.")
+    return values
+
+
+def _measurement(value, units_per_metre: int):
+    return 0 if value is None else round(value * units_per_metre) + 1
+
+
+def encode_snapshot(points):
+    """Encode TreePoints as a snapshot."""
+    rows = [
+        (
+            round(point.latitude * COORDINATE_SCALE),
+            round(point.longitude * COORDINATE_SCALE),
+            point.id,
+            _measurement(point.height, 100),
+            _measurement(point.diameter, 1000),
+        )
+        for point in points
+    ]
+    band = round(BAND_DEGREES * COORDINATE_SCALE)
+    rows.sort(key=lambda row: (row[0] // band, row[1]))
+
+    columns = {name: bytearray() for name in COLUMNS}
+    previous_id = previous_lat = previous_lon = 0
+    for latitude, longitude, tree_id, height, diameter in rows:
+        _write_varint(columns["id"], tree_id - previous_id)
+        _write_varint(columns["latitude"], latitude - previous_lat)
+        _write_varint(columns["longitude"], longitude - previous_lon)
+        _write_varint(columns["height_cm"], height)
+        _write_varint(columns["diameter_mm"], diameter)
+        previous_id, previous_lat, previous_lon = tree_id, latitude, longitude
+
+    return msgpack.packb(
+        {
+            "format": SNAPSHOT_FORMAT,
+            "count": len(rows),
+            "scale": COORDINATE_SCALE,
+            **{name: bytes(column) for name, column in columns.items()},
+        }
+    )
+
+
+def decode_snapshot(data: bytes):
+    """The TreePoints in a snapshot, in snapshot order."""
+    snapshot = msgpack.unpackb(data)
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError("Unsupported snapshot format.")
+    count = snapshot["count"]
+    scale = snapshot["scale"]
+    columns = {name: _read_varints(snapshot[name], count) for name in COLUMNS}
+
+    points = []
+    tree_id = latitude = longitude = 0
+    for i in range(count):
+        tree_id += columns["id"][i]
+        latitude += columns["latitude"][i]
+        longitude += columns["longitude"][i]
+        height = columns["height_cm"][i]
+        diameter = columns["diameter_mm"][i]
+        points.append(
+            TreePoint(
+                tree_id,
+                latitude / scale,
+                longitude / scale,
+                (height - 1) / 100 if height else None,
+                (diameter - 1) / 1000 if diameter else None,
+            )
+        )
+    return points
+
+
+def build_snapshot(db: Session):
+    rows = db.execute(
+        select(Tree.id, Tree.latitude, Tree.longitude, Tree.height, Tree.diameter)
+        .execution_options(yield_per=10000)
+    )
+    return encode_snapshot(TreePoint.from_row(row) for row in rows)
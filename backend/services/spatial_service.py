@@ -0,0 +1,97 @@
+import math
+from typing import NamedTuple
+
+EARTH_RADIUS_M = 6_371_000
+METRES_PER_DEGREE = 111_320
+
+# Size of the cells stored in Tree.grid_cell. Stored keys depend on it, so
+# changing it means re-running `python manage.py backfill-grid-cells`.
+GRID_CELL_M = 10
+
+_COL_BITS = 32
+
+
+class TreePoint(NamedTuple):
+    """The values of a tree that derived spatial structures care about."""
+    id: int | None
+    latitude: float
+    longitude: float
+    height: float | None = None
+    diameter: float | None = None
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row.id,
+            float(row.latitude),
+            float(row.longitude),
+            row.height,
+            row.diameter,
+        )
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float):
+    """Great-circle distance in metres between two WGS84 points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _row_step(cell_m: float):
+    return cell_m / METRES_PER_DEGREE
+
+
+def _col_step(row: int, cell_m: float):
+    step = _row_step(cell_m)
+    row_lat = -90 + (row + 0.5) * step
+    return step / max(math.cos(math.radians(row_lat)), 0.01)
+
+
+def cell_row(lat: float, cell_m: float = GRID_CELL_M):
+    return math.floor((lat + 90) / _row_step(cell_m))
+
+
+def cell_col(row: int, lon: float, cell_m: float = GRID_CELL_M):
+    return math.floor((lon + 180) / _col_step(row, cell_m))
+
+
+def cell_key(row: int, col: int):
+    return (row << _COL_BITS) | col
+
+
+def split_cell_key(key: int):
+    return key >> _COL_BITS, key & ((1 << _COL_BITS) - 1)
+
+
+def grid_cell(lat: float, lon: float, cell_m: float = GRID_CELL_M):
+    """
+    Key of the roughly cell_m x cell_m cell containing the point.
+
+    Rows are bands of latitude; inside a row the column width is scaled by the
+    cosine of the row's latitude so every cell covers about the same ground
+    distance. The key packs (row, col) into one integer so it can be served by
+    a plain B-tree index.
+    """
+    row = cell_row(lat, cell_m)
+    return cell_key(row, cell_col(row, lon, cell_m))
+
+
+def neighbour_cells(lat: float, lon: float, radius_m: float, cell_m: float = GRID_CELL_M):
+    """
+    Keys of every cell that may contain a point within radius_m of (lat, lon).
+    """
+    rings = max(1, math.ceil(radius_m / cell_m))
+    row = cell_row(lat, cell_m)
+    keys = []
+    for r in range(max(0, row - rings), row + rings + 1):
+        col = cell_col(r, lon, cell_m)
+        keys.extend(
+            cell_key(r, c) for c in range(max(0, col - rings), col + rings + 1)
+        )
+    return keys
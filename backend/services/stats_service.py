@@ -0,0 +1,207 @@
+import math
+import os
+from sqlalchemy import bindparam, delete, func, select
+from sqlalchemy.orm import Session
+from database import increment_statement
+from models.tree_stats_model import TreeStatsBin, TreeStatsCell
+
+# Cell size in degrees of each level. A query uses the finest level at which
+# its bounding box spans at most STATS_MAX_CELLS cells, so its cost depends
+# on that limit and not on the number of trees.
+STATS_CELL_DEGREES = (0.01, 0.1, 1.0, 10.0)
+STATS_MAX_CELLS = int(os.getenv("TREE_STATS_MAX_CELLS", "1024"))
+
+# Fixed histogram bins: (bin width, number of bins) per metric. The last bin
+# also holds everything above it.
+HISTOGRAMS = {"height": (2.0, 20), "diameter": (0.1, 20)}
+
+CELL_KEYS = ("level", "cell_x", "cell_y")
+CELL_TOTALS = (
+    "count",
+    "height_count",
+    "height_sum",
+    "height_sumsq",
+    "diameter_count",
+    "diameter_sum",
+    "diameter_sumsq",
+)
+BIN_KEYS = ("level", "cell_x", "cell_y", "metric", "bin")
+
+
+def stats_cell(latitude: float, longitude: float, level: int):
+    size = STATS_CELL_DEGREES[level]
+    return math.floor((longitude + 180) / size), math.floor((latitude + 90) / size)
+
+
+def histogram_bin(metric: str, value: float):
+    width, bins = HISTOGRAMS[metric]
+    return min(max(math.floor(value / width), 0), bins - 1)
+
+
+def _add_point(cells: dict, bins: dict, point, sign: int):
+    for level in range(len(STATS_CELL_DEGREES)):
+        key = (level, *stats_cell(point.latitude, point.longitude, level))
+        delta = cells.setdefault(key, [0, 0, 0.0, 0.0, 0, 0.0, 0.0])
+        delta[0] += sign
+        for offset, metric in ((1, "height"), (4, "diameter")):
+            value = getattr(point, metric)
+            if value is None:
+                continue
+            delta[offset] += sign
+            delta[offset + 1] += sign * value
+            delta[offset + 2] += sign * value * value
+            bin_key = (*key, metric, histogram_bin(metric, value))
+            bins[bin_key] = bins.get(bin_key, 0) + sign
+
+
+def _delete_empty(db: Session, table, keys: tuple, rows: list):
+    db.execute(
+        delete(table).where(
+            *(table.c[name] == bindparam(name) for name in keys),
+            table.c.count <= 0,
+        ),
+        rows,
+    )
+
+
+def apply_stats_changes(db: Session, added=(), removed=()):
+    """
+    Fold added and removed TreePoints into the statistics of every level.
+    Runs inside the caller's transaction; the caller commits.
+    """
+    cells = {}
+    bins = {}
+    for point in added:
+        _add_point(cells, bins, point, 1)
+    for point in removed:
+        _add_point(cells, bins, point, -1)
+    bins = {key: delta for key, delta in bins.items() if delta}
+
+    if cells:
+        table = TreeStatsCell.__table__
+        rows = [
+            {**dict(zip(CELL_KEYS, key)), **dict(zip(CELL_TOTALS, delta))}
+            for key, delta in cells.items()
+        ]
+        db.execute(increment_statement(db, table, CELL_KEYS, CELL_TOTALS), rows)
+        emptied = [dict(zip(CELL_KEYS, key)) for key, delta in cells.items() if delta[0] < 0]
+        if emptied:
+            _delete_empty(db, table, CELL_KEYS, emptied)
+    if bins:
+        table = TreeStatsBin.__table__
+        rows = [{**dict(zip(BIN_KEYS, key)), "count": delta} for key, delta in bins.items()]
+        db.execute(increment_statement(db, table, BIN_KEYS, ("count",)), rows)
+        emptied = [dict(zip(BIN_KEYS, key)) for key, delta in bins.items() if delta < 0]
+        if emptied:
+            _delete_empty(db, table, BIN_KEYS, emptied)
+
+
+def rebuild_stats(db: Session, points):
+    """Recompute every statistic from an iterable of TreePoint batches."""
+    db.execute(delete(TreeStatsBin))
+    db.execute(delete(TreeStatsCell))
+    for batch in points:
+        apply_stats_changes(db, added=batch)
+    db.commit()
+
+
+def stats_level(bbox: dict):
+    """The finest level at which bbox spans at most STATS_MAX_CELLS cells."""
+    for level in range(len(STATS_CELL_DEGREES)):
+        min_x, min_y = stats_cell(bbox["min_lat"], bbox["min_lon"], level)
+        max_x, max_y = stats_cell(bbox["max_lat"], bbox["max_lon"], level)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= STATS_MAX_CELLS:
+            return level
+    return len(STATS_CELL_DEGREES) - 1
+
+
+def _cell_edge(index: int, size: float, origin: int):
+    # The last cell may reach past the pole or the antimeridian.
+    return round(min(index * size - origin, origin), 9)
+
+
+def _metric_summary(metric: str, count: int, total: float, squares: float, counts: dict):
+    width, bins = HISTOGRAMS[metric]
+    mean = total / count if count else None
+    variance = max(squares / count - mean * mean, 0.0) if count else None
+    return {
+        "count": count,
+        "mean": mean,
+        "stddev": math.sqrt(variance) if count else None,
+        "histogram": {
+            "bin_width": width,
+            "counts": [counts.get((metric, i), 0) for i in range(bins)],
+        },
+    }
+
+
+def get_stats(db: Session, bbox: dict, include_cells: bool = False):
+    """
+    Totals, mean, standard deviation and histograms of the heights and
+    diameters inside bbox. bbox is widened to whole cells of the chosen
+    level; the covered box is returned with the statistics.
+    """
+    bbox = {
+        "min_lat": -90.0, "min_lon": -180.0, "max_lat": 90.0, "max_lon": 180.0,
+        **{name: value for name, value in bbox.items() if value is not None},
+    }
+    level = stats_level(bbox)
+    size = STATS_CELL_DEGREES[level]
+    min_x, min_y = stats_cell(bbox["min_lat"], bbox["min_lon"], level)
+    max_x, max_y = stats_cell(bbox["max_lat"], bbox["max_lon"], level)
+
+    def in_cells(model):
+        return (
+            model.level == level,
+            model.cell_x.between(min_x, max_x),
+            model.cell_y.between(min_y, max_y),
+        )
+
+    columns = TreeStatsCell.__table__.c
+    totals = db.execute(
+        select(*(func.coalesce(func.sum(columns[name]), 0) for name in CELL_TOTALS))
+        .where(*in_cells(TreeStatsCell))
+    ).one()
+    totals = dict(zip(CELL_TOTALS, totals))
+    counts = {
+        (metric, bin_): count
+        for metric, bin_, count in db.execute(
+            select(TreeStatsBin.metric, TreeStatsBin.bin, func.sum(TreeStatsBin.count))
+            .where(*in_cells(TreeStatsBin))
+            .group_by(TreeStatsBin.metric, TreeStatsBin.bin)
+        )
+    }
+    stats = {
+        "bbox": {
+            "min_lat": _cell_edge(min_y, size, 90),
+            "min_lon": _cell_edge(min_x, size, 180),
+            "max_lat": _cell_edge(max_y + 1, size, 90),
+            "max_lon": _cell_edge(max_x + 1, size, 180),
+        },
+        "cell_degrees": size,
+        "count": totals["count"],
+        **{
+            metric: _metric_summary(
+                metric,
+                totals[f"{metric}_count"],
+                totals[f"{metric}_sum"],
+                totals[f"{metric}_sumsq"],
+                counts,
+            )
+            for metric in HISTOGRAMS
+        },
+    }
+    if include_cells:
+        stats["cells"] = [
+            {
+                "min_lat": _cell_edge(cell.cell_y, size, 90),
+                "min_lon": _cell_edge(cell.cell_x, size, 180),
+                "count": cell.count,
+            }
+            for cell in db.execute(
+                select(TreeStatsCell.cell_x, TreeStatsCell.cell_y, TreeStatsCell.count)
+                .where(*in_cells(TreeStatsCell))
+                .order_by(TreeStatsCell.cell_y, TreeStatsCell.cell_x)
+            )
+        ]
+    return stats
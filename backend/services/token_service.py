@@ -3,12 +3,23 @@ from sqlalchemy.orm import Session
 from database import SessionLocal
 from datetime import datetime, timedelta, timezone
 from models.revoked_token_model import RevokedToken
+from services.revocation_service import add_revocation, is_revoked, token_digest
 from fastapi import FastAPI, Depends, HTTPException, status
 
 import os
+import threading
+import time
+from collections import OrderedDict
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+
+# Verified tokens by digest: (exp as epoch seconds or None, username).
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_hits = 0
+_token_cache_misses = 0
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -18,16 +29,72 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def _cached_username(digest: str):
+    global _token_cache_hits, _token_cache_misses
+    with _token_cache_lock:
+        entry = _token_cache.get(digest)
+        if entry is not None and (entry[0] is None or entry[0] > time.time()):
+            _token_cache.move_to_end(digest)
+            _token_cache_hits += 1
+            return entry[1]
+        if entry is not None:
+            del _token_cache[digest]
+        _token_cache_misses += 1
+        return None
+
+
+def _cache_username(digest: str, exp, username: str):
+    with _token_cache_lock:
+        _token_cache[digest] = (exp, username)
+        _token_cache.move_to_end(digest)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
+def invalidate_cached_token(token: str):
+    with _token_cache_lock:
+        _token_cache.pop(token_digest(token), None)
+
+
+def token_cache_stats():
+    with _token_cache_lock:
+        lookups = _token_cache_hits + _token_cache_misses
+        return {
+            "size": len(_token_cache),
+            "max_size": TOKEN_CACHE_SIZE,
+            "hits": _token_cache_hits,
+            "misses": _token_cache_misses,
+            "hit_rate": _token_cache_hits / lookups if lookups else 0.0,
+        }
+
+
+def clear_token_cache():
+    global _token_cache_hits, _token_cache_misses
+    with _token_cache_lock:
+        _token_cache.clear()
+        _token_cache_hits = 0
+        _token_cache_misses = 0
+
+
 def verify_token(token: str, db: Session):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
+        digest = token_digest(token)
+        username = _cached_username(digest)
         if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token.")
-        revoked_token = (
-            db.query(RevokedToken).filter(RevokedToken.token == token).first()
-        )
-        if revoked_token:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise HTTPException(status_code=401, detail="Invalid token.")
+            _cache_username(digest, payload.get("exp"), username)
+        revoked = is_revoked(token)
+        if revoked is None:
+            revoked = (
+                db.query(RevokedToken)
+                .filter(RevokedToken.token_hash == digest)
+                .first()
+                is not None
+            )
+        if revoked:
             raise HTTPException(status_code=401, detail="Token has been revoked.")
         return username
     except JWTError:
@@ -35,7 +102,9 @@ def verify_token(token: str, db: Session):
 
 
 def revoke_token(token: str, db: Session):
-    existing_token = db.query(RevokedToken).filter_by(token=token).first()
+    existing_token = (
+        db.query(RevokedToken).filter_by(token_hash=token_digest(token)).first()
+    )
     if existing_token:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -43,9 +112,22 @@ def revoke_token(token: str, db: Session):
             headers={"WWW-Authenticate": "Bearer"},
         )
     try:
-        revoked_token = RevokedToken(token=token)
+        payload = jwt.decode(
+            token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False}
+        )
+        exp = payload.get("exp")
+        revoked_token = RevokedToken(
+            token_hash=token_digest(token),
+            expires_at=(
+                datetime.fromtimestamp(exp, timezone.utc).replace(tzinfo=None)
+                if exp is not None
+                else None
+            ),
+        )
         db.add(revoked_token)
         db.commit()
+        add_revocation(token)
+        invalidate_cached_token(token)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,48 +1,601 @@
 from sqlalchemy.orm import Session
+import base64
+import binascii
+from datetime import datetime
+import os
+import orjson
 import sys
 sys.path.append("..")
 from models.tree_model import Tree
 from fastapi import HTTPException
-from sqlalchemy import and_, func
+from sqlalchemy import and_, delete, insert, or_, select, update
 from fastapi import APIRouter, Depends, HTTPException, Request
 from database import SessionLocal
+from services.cache_service import bump_tree_version
+from services.change_service import next_change_seq, record_tree_changes
+from models.tree_tombstone_model import TreeTombstone
+from services.cluster_service import apply_cluster_changes
+from services.event_service import publish_tree_changes
+from services.nearest_service import apply_nearest_changes
+from services.spatial_service import TreePoint, grid_cell, haversine_m, neighbour_cells
+from services.stats_service import apply_stats_changes
 
+# Trees closer than this to an existing tree are treated as the same tree.
+DUPLICATE_RADIUS_M = float(os.getenv("TREE_DUPLICATE_RADIUS_M", "10"))
+BULK_CHUNK_SIZE = int(os.getenv("TREE_BULK_CHUNK_SIZE", "500"))
+STREAM_CHUNK_SIZE = int(os.getenv("TREE_STREAM_CHUNK_SIZE", "1000"))
+# Coordinates are served with this many decimals; 7 is about 1 cm.
+COORDINATE_DECIMALS = int(os.getenv("TREE_COORDINATE_DECIMALS", "7"))
 
+GEOJSON_MEDIA_TYPE = "application/geo+json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 
-def create_tree(tree: Tree, db: Session):
-    radius = 0.0001
-    db_tree = (
-        db.query(Tree)
-        .filter(
-            func.abs(Tree.latitude - tree.latitude) < radius,
-            func.abs(Tree.longitude - tree.longitude) < radius,
-        )
-        .first()
+
+def _record_changes(db: Session, added=(), removed=(), seq: int | None = None):
+    """
+    Keep the tables derived from trees in step with added and removed
+    TreePoints (an update is both). seq is the change sequence number an
+    insert already wrote, see record_tree_changes. Runs in the caller's
+    transaction and returns the change sequence number for
+    _changes_committed.
+    """
+    apply_cluster_changes(db, added, removed)
+    apply_stats_changes(db, added, removed)
+    return record_tree_changes(db, added, removed, seq)
+
+
+def _insert_values(seq: int):
+    """Columns every inserted tree gets: its change seq and equal timestamps."""
+    now = datetime.utcnow()
+    return {"change_seq": seq, "added_at": now, "updated_at": now}
+
+
+def _changes_committed(seq: int, added=(), removed=()):
+    """
+    Update the in-process structures and notify subscribers once a change
+    has been committed.
+    """
+    bump_tree_version()
+    apply_nearest_changes(added, removed)
+    publish_tree_changes(seq, added, removed)
+
+
+def find_nearby_tree(latitude: float, longitude: float, db: Session):
+    candidates = db.query(Tree).filter(
+        Tree.grid_cell.in_(
+            neighbour_cells(latitude, longitude, DUPLICATE_RADIUS_M)
+        )
     )
+    for candidate in candidates:
+        distance = haversine_m(
+            latitude, longitude, float(candidate.latitude), float(candidate.longitude)
+        )
+        if distance <= DUPLICATE_RADIUS_M:
+            return candidate
+    return None
+
+
+def create_tree(tree: Tree, db: Session):
+    db_tree = find_nearby_tree(tree.latitude, tree.longitude, db)
     if not db_tree:
-        db_tree = Tree(**tree.dict())
+        seq = next_change_seq(db)
+        db_tree = Tree(**tree.dict(), **_insert_values(seq))
+        db_tree.grid_cell = grid_cell(tree.latitude, tree.longitude)
         db.add(db_tree)
+        db.flush()
+        added = [TreePoint.from_row(db_tree)]
+        _record_changes(db, added=added, seq=seq)
         db.commit()
+        _changes_committed(seq, added=added)
         db.refresh(db_tree)
     return db_tree
 
+def tree_from_feature(feature: dict):
+    """
+    Turn a GeoJSON Point feature from the detection pipeline into tree values.
+    Coordinates are [latitude, longitude], the order written by
+    locatie-bepaling/combinationstereo.py. Raises ValueError when unusable.
+    """
+    if not isinstance(feature, dict):
+        raise ValueError("Feature is not an object.")
+    geometry = feature.get("geometry") or {}
+    properties = feature.get("properties") or {}
+    coordinates = geometry.get("coordinates")
+    if (
+        geometry.get("type") != "Point"
+        or not isinstance(coordinates, list)
+        or len(coordinates) != 2
+    ):
+        raise ValueError("Invalid geometry, expected a 'Point'.")
+    latitude, longitude = coordinates
+    if not all(
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        for value in coordinates
+    ):
+        raise ValueError("Coordinates must be numbers.")
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError("Coordinates are out of range.")
+    tree_id = properties.get("tree_id")
+    name = properties.get("name") or (f"Tree {tree_id}" if tree_id else None)
+    if not name:
+        raise ValueError("'tree_id' is missing in properties.")
+    return {
+        "name": str(name)[:100],
+        "description": properties.get("description", "N.v.t"),
+        "latitude": float(latitude),
+        "longitude": float(longitude),
+    }
+
+
+def _find_in_cells(cells: dict, latitude: float, longitude: float):
+    for key in neighbour_cells(latitude, longitude, DUPLICATE_RADIUS_M):
+        for other_lat, other_lon, ref in cells.get(key, ()):
+            if haversine_m(latitude, longitude, other_lat, other_lon) <= DUPLICATE_RADIUS_M:
+                return ref
+    return None
+
+
+def _bulk_create_chunk(chunk: list[tuple[int, dict]], db: Session):
+    lookup_cells = set()
+    for _, values in chunk:
+        lookup_cells.update(
+            neighbour_cells(values["latitude"], values["longitude"], DUPLICATE_RADIUS_M)
+        )
+    cells = {}
+    existing = db.execute(
+        select(Tree.id, Tree.latitude, Tree.longitude, Tree.grid_cell).where(
+            Tree.grid_cell.in_(lookup_cells)
+        )
+    )
+    for tree_id, latitude, longitude, cell in existing:
+        cells.setdefault(cell, []).append(
+            (float(latitude), float(longitude), {"duplicate_of": tree_id})
+        )
+
+    results = {}
+    rows = []
+    for index, values in chunk:
+        match = _find_in_cells(cells, values["latitude"], values["longitude"])
+        if match:
+            results[index] = {"index": index, "status": "duplicate", **match}
+            continue
+        cell = grid_cell(values["latitude"], values["longitude"])
+        cells.setdefault(cell, []).append(
+            (values["latitude"], values["longitude"], {"duplicate_of_index": index})
+        )
+        rows.append({**values, "grid_cell": cell})
+        results[index] = {"index": index, "status": "inserted"}
+
+    if rows:
+        seq = next_change_seq(db)
+        values = _insert_values(seq)
+        db.execute(insert(Tree), [{**row, **values} for row in rows])
+        known_ids = {
+            match["duplicate_of"]
+            for entries in cells.values()
+            for _, _, match in entries
+            if "duplicate_of" in match
+        }
+        inserted = db.execute(
+            select(
+                Tree.id, Tree.latitude, Tree.longitude, Tree.height, Tree.diameter
+            ).where(Tree.grid_cell.in_({row["grid_cell"] for row in rows}))
+        )
+        added = [
+            TreePoint.from_row(row) for row in inserted if row.id not in known_ids
+        ]
+        _record_changes(db, added=added, seq=seq)
+        db.commit()
+        _changes_committed(seq, added=added)
+    return results
+
+
+def bulk_create_trees(trees: list[tuple[int, dict]], db: Session):
+    """
+    Insert many (index, values) pairs with the duplicate semantics of
+    create_tree. Each chunk costs one candidate query, one executemany and one
+    commit. Returns a result per index, "inserted" or "duplicate".
+    """
+    results = {}
+    for start in range(0, len(trees), BULK_CHUNK_SIZE):
+        results.update(_bulk_create_chunk(trees[start:start + BULK_CHUNK_SIZE], db))
+    return results
+
+
+# The columns of a tree as served by the API, selected as plain rows so
+# listings skip ORM hydration.
+TREE_COLUMNS = (
+    Tree.id,
+    Tree.name,
+    Tree.description,
+    Tree.latitude,
+    Tree.longitude,
+    Tree.height,
+    Tree.diameter,
+    Tree.added_at,
+    Tree.updated_at,
+)
+
+
 def get_all_trees(db: Session):
-    return db.query(Tree).all()
+    return db.execute(select(*TREE_COLUMNS).order_by(Tree.id)).all()
+
+
+def tree_dict(row):
+    return {
+        "id": row.id,
+        "name": row.name,
+        "description": row.description,
+        "latitude": round(float(row.latitude), COORDINATE_DECIMALS),
+        "longitude": round(float(row.longitude), COORDINATE_DECIMALS),
+        "height": row.height,
+        "diameter": row.diameter,
+        "added_at": row.added_at.isoformat() if row.added_at else None,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+    }
+
+
+def encode_cursor(value: int):
+    return base64.urlsafe_b64encode(str(value).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def encode_change_cursor(seq: int, tree_id: int | None = None):
+    """
+    Cursor into the change feed: everything up to and including tree_id
+    within change seq, or all of seq when tree_id is None.
+    """
+    value = str(seq) if tree_id is None else f"{seq}.{tree_id}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def decode_change_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        seq, _, tree_id = base64.urlsafe_b64decode(padded.encode()).decode().partition(".")
+        return int(seq), int(tree_id) if tree_id else None
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+_RANGE_FILTERS = {
+    "min_lat": (Tree.latitude, "min"),
+    "max_lat": (Tree.latitude, "max"),
+    "min_lon": (Tree.longitude, "min"),
+    "max_lon": (Tree.longitude, "max"),
+    "min_height": (Tree.height, "min"),
+    "max_height": (Tree.height, "max"),
+    "min_diameter": (Tree.diameter, "min"),
+    "max_diameter": (Tree.diameter, "max"),
+    "added_after": (Tree.added_at, "min"),
+    "added_before": (Tree.added_at, "max"),
+}
+
+
+def tree_filter_clauses(filters: dict):
+    """
+    WHERE clauses for the bounding-box, height/diameter and added_at filters
+    of GET /trees and the bulk endpoints. Missing or None values are ignored.
+    """
+    clauses = []
+    for name, (column, bound) in _RANGE_FILTERS.items():
+        value = filters.get(name)
+        if value is not None:
+            clauses.append(column >= value if bound == "min" else column <= value)
+    return clauses
+
+
+def get_trees_page(
+    db: Session, filters: dict, limit: int | None = None, after_id: int | None = None
+):
+    """
+    Trees matching filters ordered by id, starting after after_id. Returns the
+    page and the id to continue from, or None when this was the last page.
+    """
+    query = select(*TREE_COLUMNS).where(*tree_filter_clauses(filters))
+    if after_id is not None:
+        query = query.where(Tree.id > after_id)
+    query = query.order_by(Tree.id)
+    if limit is None:
+        return db.execute(query).all(), None
+    trees = db.execute(query.limit(limit + 1)).all()
+    if len(trees) > limit:
+        return trees[:limit], trees[limit - 1].id
+    return trees, None
+
+def _after_change(seq_column, id_column, seq: int, tree_id: int | None):
+    if tree_id is None:
+        return seq_column > seq
+    return or_(seq_column > seq, and_(seq_column == seq, id_column > tree_id))
+
+
+def get_tree_changes(db: Session, seq: int = 0, tree_id: int | None = None, limit: int = 500):
+    """
+    Inserted or updated trees and deleted tree ids after the change cursor
+    (seq, tree_id), in change order. Returns the changes and whether more
+    remain.
+    """
+    trees = db.execute(
+        select(*TREE_COLUMNS, Tree.change_seq)
+        .where(_after_change(Tree.change_seq, Tree.id, seq, tree_id))
+        .order_by(Tree.change_seq, Tree.id)
+        .limit(limit + 1)
+    ).all()
+    tombstones = db.execute(
+        select(TreeTombstone)
+        .where(_after_change(TreeTombstone.change_seq, TreeTombstone.tree_id, seq, tree_id))
+        .order_by(TreeTombstone.change_seq, TreeTombstone.tree_id)
+        .limit(limit + 1)
+    ).scalars().all()
+
+    changes = [
+        (row.change_seq, row.id, {"op": "upsert", "id": row.id, "tree": tree_dict(row)})
+        for row in trees
+    ] + [
+        (
+            tombstone.change_seq,
+            tombstone.tree_id,
+            {
+                "op": "delete",
+                "id": tombstone.tree_id,
+                "deleted_at": tombstone.deleted_at.isoformat() if tombstone.deleted_at else None,
+            },
+        )
+        for tombstone in tombstones
+    ]
+    changes.sort(key=lambda change: change[:2])
+    return changes[:limit], len(changes) > limit
+
 
 def delete_tree(tree_id: int, db: Session):
     db_tree = db.query(Tree).filter(Tree.id == tree_id).first()
     if not db_tree:
         raise HTTPException(status_code=404, detail="Tree not found")
+    removed = [TreePoint.from_row(db_tree)]
+    seq = _record_changes(db, removed=removed)
     db.delete(db_tree)
     db.commit()
+    _changes_committed(seq, removed=removed)
     return {"message": "Tree deleted successfully"}
 
 def update_tree(tree_id: int, height: int, diameter: int, db: Session):
     db_tree = db.query(Tree).filter(Tree.id == tree_id).first()
     if not db_tree:
         raise HTTPException(status_code=404, detail="Tree not found")
+    removed = [TreePoint.from_row(db_tree)]
     db_tree.height = height
     db_tree.diameter = diameter
+    added = [TreePoint.from_row(db_tree)]
+    seq = _record_changes(db, added=added, removed=removed)
     db.commit()
+    _changes_committed(seq, added=added, removed=removed)
     db.refresh(db_tree)
-    return db_tree
\ No newline at end of file
+    return db_tree
+
+
+def _locked_tree_points(db: Session, *clauses):
+    """TreePoints of the trees matching clauses, locked until the caller commits."""
+    rows = db.execute(
+        select(Tree.id, Tree.latitude, Tree.longitude, Tree.height, Tree.diameter)
+        .where(*clauses)
+        .order_by(Tree.id)
+        .with_for_update()
+    )
+    return [TreePoint.from_row(row) for row in rows]
+
+
+def _target_tree_points(db: Session, ids=None, filters: dict | None = None):
+    if ids is None:
+        return _locked_tree_points(db, *tree_filter_clauses(filters or {}))
+    ids = sorted(set(ids))
+    points = []
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        points += _locked_tree_points(db, Tree.id.in_(ids[start:start + BULK_CHUNK_SIZE]))
+    return points
+
+
+def _id_batches(points: list):
+    ids = [point.id for point in points]
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        yield ids[start:start + BULK_CHUNK_SIZE]
+
+
+def bulk_update_trees(
+    db: Session,
+    changes: list[dict] | None = None,
+    filters: dict | None = None,
+    values: dict | None = None,
+):
+    """
+    Update many trees in one transaction: per-tree values given as changes,
+    [{"id": 1, "height": 12.5}, ...], or the same values for every tree
+    matching filters. Only the keys present are changed and unknown ids are
+    skipped. Returns the number of trees updated.
+    """
+    if changes is not None:
+        by_id = {change["id"]: change for change in changes}
+        removed = _target_tree_points(db, ids=list(by_id))
+        if removed:
+            # Executemany UPDATE by primary key, one statement per key set.
+            db.execute(update(Tree), [by_id[point.id] for point in removed])
+        added = [point._replace(**by_id[point.id]) for point in removed]
+    else:
+        removed = _target_tree_points(db, filters=filters)
+        for batch in _id_batches(removed):
+            db.execute(
+                update(Tree)
+                .where(Tree.id.in_(batch))
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        added = [point._replace(**values) for point in removed]
+    seq = _record_changes(db, added=added, removed=removed)
+    db.commit()
+    if removed:
+        _changes_committed(seq, added=added, removed=removed)
+    return len(removed)
+
+
+def bulk_delete_trees(db: Session, ids=None, filters: dict | None = None):
+    """
+    Delete the trees with the given ids, or every tree matching filters, in
+    one transaction. Returns the number of trees deleted.
+    """
+    removed = _target_tree_points(db, ids=ids, filters=filters)
+    for batch in _id_batches(removed):
+        db.execute(
+            delete(Tree)
+            .where(Tree.id.in_(batch))
+            .execution_options(synchronize_session=False)
+        )
+    seq = _record_changes(db, removed=removed)
+    db.commit()
+    if removed:
+        _changes_committed(seq, removed=removed)
+    return len(removed)
+
+
+def merge_tree_groups(db: Session, groups: list[list[int]], combine):
+    """
+    Merge each group of tree ids into its lowest id in one transaction.
+    combine(points) gets the locked TreePoints of a group, ordered by id, and
+    returns the values to store on the kept tree; the other trees are deleted.
+    Groups with fewer than two remaining trees are skipped. Returns the
+    (kept TreePoint, merged ids) of every merged group.
+    """
+    locked = {point.id: point for point in _target_tree_points(
+        db, ids=[tree_id for group in groups for tree_id in group]
+    )}
+    merged = []
+    for group in groups:
+        points = sorted(
+            (locked[tree_id] for tree_id in set(group) if tree_id in locked),
+            key=lambda point: point.id,
+        )
+        if len(points) > 1:
+            kept = points[0]._replace(**combine(points))
+            merged.append((kept, points))
+    if not merged:
+        db.rollback()
+        return []
+
+    db.execute(
+        update(Tree),
+        [
+            {**kept._asdict(), "grid_cell": grid_cell(kept.latitude, kept.longitude)}
+            for kept, _ in merged
+        ],
+    )
+    removed = [point for _, points in merged for point in points]
+    for batch in _id_batches([point for _, points in merged for point in points[1:]]):
+        db.execute(
+            delete(Tree)
+            .where(Tree.id.in_(batch))
+            .execution_options(synchronize_session=False)
+        )
+    added = [kept for kept, _ in merged]
+    seq = _record_changes(db, added=added, removed=removed)
+    db.commit()
+    _changes_committed(seq, added=added, removed=removed)
+    return [(kept, [point.id for point in points[1:]]) for kept, points in merged]
+
+
+def iter_tree_points(db: Session, batch_size: int = 1000):
+    """Yield every tree as lists of at most batch_size TreePoints, by id."""
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(Tree.id, Tree.latitude, Tree.longitude, Tree.height, Tree.diameter)
+            .where(Tree.id > last_id)
+            .order_by(Tree.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return
+        yield [TreePoint.from_row(row) for row in batch]
+        last_id = batch[-1].id
+
+
+def backfill_grid_cells(db: Session, only_missing: bool = True, batch_size: int = 1000):
+    """
+    Recompute Tree.grid_cell, by default only for rows that do not have one
+    yet. Returns the number of rows updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        query = db.query(Tree).filter(Tree.id > last_id)
+        if only_missing:
+            query = query.filter(Tree.grid_cell.is_(None))
+        batch = query.order_by(Tree.id).limit(batch_size).all()
+        if not batch:
+            return updated
+        for db_tree in batch:
+            db_tree.grid_cell = grid_cell(
+                float(db_tree.latitude), float(db_tree.longitude)
+            )
+        db.commit()
+        updated += len(batch)
+        last_id = batch[-1].id
+
+
+def encode_trees(rows):
+    """A JSON array of tree_dicts for rows, encoded with orjson."""
+    return orjson.dumps([tree_dict(row) for row in rows])
+
+
+def tree_feature(row):
+    """GeoJSON Feature for a tree row, with [latitude, longitude] coordinates."""
+    properties = tree_dict(row)
+    coordinates = [properties.pop("latitude"), properties.pop("longitude")]
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": coordinates},
+        "properties": properties,
+    }
+
+
+def _features_statement(filters: dict):
+    return (
+        select(*TREE_COLUMNS)
+        .where(*tree_filter_clauses(filters))
+        .order_by(Tree.id)
+        .execution_options(yield_per=STREAM_CHUNK_SIZE)
+    )
+
+
+def _encode_features(rows, media_type: str, first: bool):
+    geojson = media_type == GEOJSON_MEDIA_TYPE
+    separator = "," if geojson else "\n"
+    chunk = separator.join(orjson.dumps(tree_feature(row)).decode() for row in rows)
+    if geojson:
+        return chunk if first else separator + chunk
+    return chunk + "\n"
+
+
+_COLLECTION_START = '{"type":"FeatureCollection","features":['
+_COLLECTION_END = "]}"
+
+
+def stream_tree_features(db: Session, filters: dict, media_type: str):
+    """
+    Yield the trees matching filters as a GeoJSON FeatureCollection or as
+    newline-delimited Features. Rows are fetched STREAM_CHUNK_SIZE at a time
+    through a server-side cursor, so memory does not grow with the table.
+    """
+    geojson = media_type == GEOJSON_MEDIA_TYPE
+    if geojson:
+        yield _COLLECTION_START
+    first = True
+    for rows in db.execute(_features_statement(filters)).partitions():
+        yield _encode_features(rows, media_type, first)
+        first = False
+    if geojson:
+        yield _COLLECTION_END
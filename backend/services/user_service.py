@@ -1,8 +1,9 @@
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 from models.user_model import User
 from fastapi import FastAPI, Depends, HTTPException, status
-from database import SessionLocal
+from database import DbSession, SessionLocal, run_db
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -15,28 +16,34 @@ def get_user_by_username(username: str, db: Session):
     return db.query(User).filter(User.username == username).first()
 
 
-def create_user(username: str, password: str, db: Session):
-    db_user = get_user_by_username(username, db)
+def _add_user(username: str, hashed_password: str, db: Session):
+    db_user = User(username=username, hashed_password=hashed_password)
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return {"user_id": db_user.id, "username": db_user.username}
+
+
+async def create_user(username: str, password: str, db: DbSession):
+    db_user = await run_db(db, lambda session: get_user_by_username(username, session))
     if db_user:
         raise HTTPException(
             status_code=400,
             detail=standard_response(False, "Username already registered"),
         )
-    hashed_password = pwd_context.hash(password)
-    db_user = User(username=username, hashed_password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return standard_response(
-        True,
-        "User created successfully",
-        {"user_id": db_user.id, "username": db_user.username},
+    # bcrypt is deliberately slow; keep it off the event loop.
+    hashed_password = await run_in_threadpool(pwd_context.hash, password)
+    user = await run_db(
+        db, lambda session: _add_user(username, hashed_password, session)
     )
+    return standard_response(True, "User created successfully", user)
 
 
-def authenticate_user(username: str, password: str, db: Session):
-    user = get_user_by_username(username, db)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+async def authenticate_user(username: str, password: str, db: DbSession):
+    user = await run_db(db, lambda session: get_user_by_username(username, session))
+    if not user or not await run_in_threadpool(
+        pwd_context.verify, password, user.hashed_password
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=standard_response(False, "Incorrect username or password"),
@@ -3,5 +3,19 @@
 # Start Cloud SQL Proxy in the background
 /cloud_sql_proxy -instances=buzzwatch-422510:europe-west1:mutualism-test=tcp:3306 &
 
+# `start.sh migrate` applies the schema migrations once per deploy, fills
+# derived tables a migration has just created, and exits. Retry while the
+# proxy is still starting.
+if [ "$1" = "migrate" ]; then
+    for attempt in 1 2 3 4 5 6 7 8 9 10; do
+        alembic upgrade head \
+            && python manage.py rebuild-clusters --if-empty \
+            && python manage.py rebuild-stats --if-empty \
+            && exit 0
+        sleep 3
+    done
+    exit 1
+fi
+
 # Start the Uvicorn app
 exec uvicorn main:app --host 0.0.0.0 --port 8000
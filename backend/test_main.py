@@ -1,15 +1,42 @@
+import asyncio
+import importlib
+import json
 import os
+import time
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from main import app
-from database import Base, get_db
+from metrics import instrument_engine
+from routers.tree_router import get_tree_events
+from services.event_service import get_hub
+from database import Base, get_db, get_sync_db
+from services.cache_service import clear_tree_cache
+from services.nearest_service import reset_nearest_index
+from services import import_service, tree_service
+from services.merge_service import merge_duplicates
+from services.snapshot_service import decode_snapshot
+from services.stats_service import get_stats, rebuild_stats
+from services.tree_service import iter_tree_points
+from services.token_service import clear_token_cache
+from services.revocation_service import (
+    load_revocations,
+    purge_expired_revocations,
+    token_digest,
+)
+from datetime import datetime, timedelta
+from models.import_job_model import ImportJob
+from models.revoked_token_model import RevokedToken
+from models.tree_model import Tree
 
 # SQLite in-memory database voor de tests
 SQLALCHEMY_DATABASE_URL = "sqlite:///testing.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
+instrument_engine(engine)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -22,18 +49,41 @@ def override_get_db():
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_sync_db] = override_get_db
+
+# Dezelfde database via de async driver, zoals get_db die standaard geeft
+async_engine = create_async_engine("sqlite+aiosqlite:///testing.db", poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False)
+
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
 
 
 @pytest.fixture(scope="function")
 def client():
+    # Database tabellen aanmaken, voor de app opstart en de ingetrokken tokens laadt
+    Base.metadata.create_all(bind=engine)
     with TestClient(app) as c:
-        # Database tabellen aanmaken
-        Base.metadata.create_all(bind=engine)
+        # De tabellen worden buiten de services om geleegd
+        clear_tree_cache()
+        reset_nearest_index()
         yield c
         # Droppen van de tabellen na de tests
         Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture(scope="function")
+def async_client(client):
+    """De routes met een AsyncSession, zoals in productie."""
+    app.dependency_overrides[get_db] = override_get_async_db
+    try:
+        yield client
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+
+
 def test_register_user(client):
     response = client.post(
         "/register",
@@ -269,3 +319,867 @@ def test_delete_nonexistent_tree(client):
     response = client.delete("/trees/999", headers=headers)
     assert response.status_code == 404
     assert response.json() == {"detail": "Tree not found"}
+
+
+def auth_headers(client):
+    client.post("/register", json={"username": "testuser", "password": "testpassword"})
+    login_response = client.post(
+        "/login", data={"username": "testuser", "password": "testpassword"}
+    )
+    token = login_response.json()["data"]["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_create_tree_nearby_duplicate(client):
+    """Een boom binnen de duplicaatstraal geeft de bestaande boom terug."""
+    headers = auth_headers(client)
+    tree_data = {"name": "Oak Tree", "latitude": 51.1234, "longitude": 4.5678}
+    first = client.post("/trees", json=tree_data, headers=headers).json()
+
+    # Ongeveer 3 meter verder
+    nearby = dict(tree_data, name="Oak Tree 2", latitude=51.12343)
+    second = client.post("/trees", json=nearby, headers=headers).json()
+    assert second["id"] == first["id"]
+
+    # Ongeveer 50 meter verder is een andere boom
+    far = dict(tree_data, name="Oak Tree 3", latitude=51.12385)
+    third = client.post("/trees", json=far, headers=headers).json()
+    assert third["id"] != first["id"]
+    assert len(client.get("/trees").json()) == 2
+
+
+def test_bulk_create_trees_feature_collection(client):
+    """Een volledige FeatureCollection in een keer opladen."""
+    headers = auth_headers(client)
+    client.post(
+        "/trees",
+        json={"name": "Existing", "latitude": 51.1, "longitude": 4.1},
+        headers=headers,
+    )
+
+    def feature(tree_id, coordinates, geometry_type="Point"):
+        return {
+            "type": "Feature",
+            "properties": {"tree_id": tree_id},
+            "geometry": {"type": geometry_type, "coordinates": coordinates},
+        }
+
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            feature(1, [51.2, 4.2]),
+            feature(2, [51.20002, 4.2]),  # duplicaat binnen de upload
+            feature(3, [51.10001, 4.1]),  # duplicaat van een bestaande boom
+            feature(4, [51.3, 4.3], "LineString"),
+            feature(5, [51.4, 4.4]),
+        ],
+    }
+    response = client.post("/trees/bulk", json=collection, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["inserted"], body["duplicates"], body["rejected"]) == (2, 2, 1)
+    assert [r["status"] for r in body["results"]] == [
+        "inserted", "duplicate", "duplicate", "rejected", "inserted",
+    ]
+    assert body["results"][1]["duplicate_of_index"] == 0
+    assert "duplicate_of" in body["results"][2]
+
+    names = sorted(tree["name"] for tree in client.get("/trees").json())
+    assert names == ["Existing", "Tree 1", "Tree 5"]
+
+
+def test_bulk_create_trees_list(client):
+    headers = auth_headers(client)
+    trees = [
+        {"name": "A", "latitude": 50.0, "longitude": 4.0},
+        {"name": "B", "latitude": "not a number", "longitude": 4.0},
+    ]
+    response = client.post("/trees/bulk", json=trees, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+    assert response.json()["rejected"] == 1
+
+
+def test_bulk_create_trees_requires_token(client):
+    response = client.post("/trees/bulk", json=[])
+    assert response.status_code == 401
+
+
+def wait_for_import(client, url, headers):
+    for _ in range(100):
+        job = client.get(url, headers=headers).json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    return job
+
+
+def test_import_geojson_job(client):
+    """Een GeoJSON-bestand wordt op de achtergrond geïmporteerd."""
+    headers = auth_headers(client)
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"tree_id": i},
+            "geometry": {"type": "Point", "coordinates": [51.2 + i * 0.01, 4.2]},
+        }
+        for i in range(1, 4)
+    ]
+    features.append(dict(features[0], properties={"tree_id": 9}))  # duplicaat
+    features.append({"type": "Feature", "geometry": None})  # ongeldig
+    upload = json.dumps({"type": "FeatureCollection", "features": features})
+    response = client.post(
+        "/imports",
+        params={"filename": "trees.geojson"},
+        content=upload,
+        headers={**headers, "Content-Type": "application/geo+json"},
+    )
+    assert response.status_code == 202
+    assert response.headers["Location"] == response.json()["url"]
+
+    job = wait_for_import(client, response.json()["url"], headers)
+    assert job["status"] == "done"
+    assert job["filename"] == "trees.geojson"
+    assert (job["processed"], job["inserted"], job["duplicates"], job["errors"]) == (
+        5, 3, 1, 1,
+    )
+    assert job["error_samples"][0]["index"] == 4
+    assert job["rows_per_second"] is not None
+    assert len(client.get("/trees").json()) == 3
+
+    assert client.get("/imports/unknown", headers=headers).status_code == 404
+    assert client.post("/imports", content=b"{}").status_code == 401
+
+
+def test_import_rejects_other_geojson(client):
+    """Een bestand dat geen FeatureCollection is, mislukt in plaats van leeg te slagen."""
+    headers = auth_headers(client)
+    feature = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [51, 4]}}
+    response = client.post("/imports", content=json.dumps(feature), headers=headers)
+    job = wait_for_import(client, response.json()["url"], headers)
+    assert (job["status"], job["processed"]) == ("failed", 0)
+    assert "FeatureCollection" in job["error_samples"][0]["detail"]
+
+
+def test_import_failed_upload_leaves_no_job(client, tmp_path, monkeypatch):
+    """Als het opslaan mislukt, blijft er geen job in de wachtrij hangen."""
+    headers = auth_headers(client)
+    # Een bestand waar de importmap zou moeten komen
+    blocked = tmp_path / "blocked"
+    blocked.write_text("")
+    monkeypatch.setattr(import_service, "IMPORT_DIR", str(blocked))
+    with pytest.raises(OSError):
+        client.post("/imports", content=b"{}", headers=headers)
+    db = TestingSessionLocal()
+    try:
+        assert db.query(ImportJob).count() == 0
+    finally:
+        db.close()
+
+
+def test_bulk_update_trees(client):
+    """Hoogtes per boom of voor een heel gebied in een keer aanpassen."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "A", "latitude": 51.0, "longitude": 4.0},
+        {"name": "B", "latitude": 51.1, "longitude": 4.1},
+        {"name": "C", "latitude": 52.0, "longitude": 5.0},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    ids = {tree["name"]: tree["id"] for tree in client.get("/trees").json()}
+
+    changes = [
+        {"id": ids["A"], "height": 10, "diameter": 0.5},
+        {"id": ids["C"], "diameter": 0.8},
+        {"id": 999, "height": 1},
+    ]
+    response = client.patch("/trees/bulk", json={"trees": changes}, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"updated": 2}
+
+    bbox = {"min_lat": 50.9, "max_lat": 51.5, "min_lon": 3.9, "max_lon": 4.5}
+    response = client.patch(
+        "/trees/bulk", json={"filter": bbox, "values": {"height": 12}}, headers=headers
+    )
+    assert response.json() == {"updated": 2}
+
+    trees = {tree["name"]: tree for tree in client.get("/trees").json()}
+    assert (trees["A"]["height"], trees["A"]["diameter"]) == (12, 0.5)
+    assert (trees["B"]["height"], trees["B"]["diameter"]) == (12, None)
+    assert (trees["C"]["height"], trees["C"]["diameter"]) == (None, 0.8)
+
+    # Afgeleide gegevens volgen mee
+    clusters = client.get("/trees/clusters", params={"z": 3, **bbox}).json()
+    assert clusters[0]["average_height"] == 12
+    changes = client.get("/trees/changes").json()["changes"]
+    assert {change["id"] for change in changes} == set(ids.values())
+
+    # Een lege filter of geen doel wordt geweigerd
+    for body in ({"filter": {}, "values": {"height": 1}}, {"values": {"height": 1}}):
+        assert client.patch("/trees/bulk", json=body, headers=headers).status_code == 422
+    assert client.patch("/trees/bulk", json={"trees": []}).status_code == 401
+
+
+def test_bulk_delete_trees(client):
+    """Bomen op id of binnen een gebied en tijdsvenster in een keer verwijderen."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "A", "latitude": 51.0, "longitude": 4.0},
+        {"name": "B", "latitude": 51.1, "longitude": 4.1},
+        {"name": "C", "latitude": 52.0, "longitude": 5.0},
+        {"name": "D", "latitude": 53.0, "longitude": 6.0},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    ids = {tree["name"]: tree["id"] for tree in client.get("/trees").json()}
+
+    response = client.request(
+        "DELETE", "/trees/bulk", json={"ids": [ids["D"], 999]}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json() == {"deleted": 1}
+
+    window = {
+        "added_after": (datetime.utcnow() - timedelta(hours=1)).isoformat() + "Z",
+        "added_before": (datetime.utcnow() + timedelta(hours=1)).isoformat() + "Z",
+    }
+    future = {"added_after": (datetime.utcnow() + timedelta(hours=1)).isoformat()}
+    response = client.request(
+        "DELETE", "/trees/bulk", json={"filter": future}, headers=headers
+    )
+    assert response.json() == {"deleted": 0}
+
+    bbox = {"min_lat": 50.9, "max_lat": 51.5, "min_lon": 3.9, "max_lon": 4.5}
+    response = client.request(
+        "DELETE", "/trees/bulk", json={"filter": {**bbox, **window}}, headers=headers
+    )
+    assert response.json() == {"deleted": 2}
+    assert [tree["name"] for tree in client.get("/trees").json()] == ["C"]
+    assert client.get("/trees/clusters", params={"z": 12, **bbox}).json() == []
+
+    deleted = {
+        change["id"]
+        for change in client.get("/trees/changes").json()["changes"]
+        if change["op"] == "delete"
+    }
+    assert deleted == {ids["A"], ids["B"], ids["D"]}
+
+    both = {"ids": [ids["C"]], "filter": bbox}
+    response = client.request("DELETE", "/trees/bulk", json=both, headers=headers)
+    assert response.status_code == 422
+
+
+def test_get_trees_bbox_and_pagination(client):
+    """Bomen ophalen binnen een bounding box, pagina per pagina."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": f"Tree {i}", "latitude": 51.0 + i * 0.01, "longitude": 4.0}
+        for i in range(5)
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+
+    response = client.get("/trees", params={"min_lat": 51.005, "max_lat": 51.035})
+    assert [t["name"] for t in response.json()] == ["Tree 1", "Tree 2", "Tree 3"]
+
+    first = client.get("/trees", params={"limit": 2})
+    assert [t["name"] for t in first.json()] == ["Tree 0", "Tree 1"]
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get("/trees", params={"limit": 2, "cursor": cursor})
+    assert [t["name"] for t in second.json()] == ["Tree 2", "Tree 3"]
+
+    last = client.get(
+        "/trees", params={"limit": 2, "cursor": second.headers["X-Next-Cursor"]}
+    )
+    assert [t["name"] for t in last.json()] == ["Tree 4"]
+    assert "X-Next-Cursor" not in last.headers
+
+    assert client.get("/trees", params={"cursor": "%%%"}).status_code == 400
+
+
+def test_async_session_routes(async_client):
+    """Registreren, aanmaken, wijzigen en verwijderen via een AsyncSession."""
+    client = async_client
+    headers = auth_headers(client)
+    tree = client.post(
+        "/trees", json={"name": "Async", "latitude": 51.05, "longitude": 3.72}, headers=headers
+    ).json()
+    updated = client.put(f"/trees/{tree['id']}", json={"height": 8}, headers=headers).json()
+    assert updated["height"] == 8
+
+    stats = client.get("/trees/stats").json()
+    assert (stats["count"], stats["height"]["mean"]) == (1, 8)
+    clusters = client.get("/trees/clusters", params={"z": 12}).json()
+    assert sum(cluster["count"] for cluster in clusters) == 1
+    feed = client.get("/trees/changes").json()
+    assert [(c["op"], c["id"]) for c in feed["changes"]] == [("upsert", tree["id"])]
+
+    assert client.delete(f"/trees/{tree['id']}", headers=headers).status_code == 200
+    assert client.get("/trees").json() == []
+
+
+def test_cpu_heavy_routes_leave_event_loop(async_client, monkeypatch):
+    """Encoderen en bulkwerk draaien in de threadpool, niet op de event loop."""
+    tree_router = importlib.import_module("routers.tree_router")
+    on_loop = {}
+
+    def record(name, fn):
+        def wrapper(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop[name] = True
+            except RuntimeError:
+                on_loop[name] = False
+            return fn(*args, **kwargs)
+        monkeypatch.setattr(tree_router, name, wrapper)
+
+    for name in ("encode_trees", "build_snapshot", "bulk_create_trees", "trees_within"):
+        record(name, getattr(tree_router, name))
+
+    client = async_client
+    headers = auth_headers(client)
+    trees = [{"name": "A", "latitude": 51.0, "longitude": 4.0}]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    client.get("/trees")
+    client.get("/trees/snapshot")
+    square = [[50.9, 3.9], [50.9, 4.1], [51.1, 4.1], [51.1, 3.9], [50.9, 3.9]]
+    response = client.post("/trees/within", json={"type": "Polygon", "coordinates": [square]})
+    assert response.json()["count"] == 1
+    assert on_loop == {
+        "encode_trees": False,
+        "build_snapshot": False,
+        "bulk_create_trees": False,
+        "trees_within": False,
+    }
+
+
+def test_get_trees_streaming(client):
+    """Bomen ophalen als GeoJSON of NDJSON stream."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": f"Tree {i}", "latitude": 51.0 + i * 0.01, "longitude": 4.0}
+        for i in range(3)
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+
+    response = client.get("/trees", headers={"Accept": "application/geo+json"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/geo+json")
+    collection = response.json()
+    assert collection["type"] == "FeatureCollection"
+    assert len(collection["features"]) == 3
+    assert collection["features"][1]["geometry"]["coordinates"] == [51.01, 4.0]
+    assert collection["features"][1]["properties"]["name"] == "Tree 1"
+
+    response = client.get(
+        "/trees",
+        params={"min_lat": 51.005},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    lines = response.text.splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])["properties"]["name"] == "Tree 1"
+
+    empty = client.get(
+        "/trees", params={"min_lat": 80}, headers={"Accept": "application/geo+json"}
+    )
+    assert empty.json() == {"type": "FeatureCollection", "features": []}
+
+
+def test_get_trees_etag(client):
+    """Ongewijzigde bomen geven 304 Not Modified terug."""
+    headers = auth_headers(client)
+    client.post(
+        "/trees", json={"name": "A", "latitude": 50.0, "longitude": 4.0}, headers=headers
+    )
+    first = client.get("/trees")
+    etag = first.headers["ETag"]
+
+    not_modified = client.get("/trees", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+    client.post(
+        "/trees", json={"name": "B", "latitude": 50.1, "longitude": 4.0}, headers=headers
+    )
+    changed = client.get("/trees", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.json()) == 2
+    assert changed.headers["ETag"] != etag
+
+
+def test_get_trees_compressed(client):
+    """Grote lijsten worden met brotli of gzip gecomprimeerd."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": f"Tree {i}", "latitude": 50.0 + i * 0.001, "longitude": 4.123456789}
+        for i in range(50)
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+
+    plain = client.get("/trees", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    # Coördinaten met vaste precisie
+    assert plain.json()[0]["longitude"] == 4.1234568
+
+    for encoding in ("br", "gzip"):
+        response = client.get("/trees", headers={"Accept-Encoding": encoding})
+        assert response.headers["Content-Encoding"] == encoding
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert response.json() == plain.json()
+        assert response.headers["ETag"] != plain.headers["ETag"]
+        not_modified = client.get(
+            "/trees",
+            headers={"Accept-Encoding": encoding, "If-None-Match": response.headers["ETag"]},
+        )
+        assert not_modified.status_code == 304
+
+
+def test_get_tree_snapshot(client):
+    """De binaire snapshot bevat alle bomen en volgt de dataversie."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "A", "latitude": 51.0, "longitude": 4.0},
+        {"name": "B", "latitude": 51.5, "longitude": 4.5},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+
+    response = client.get("/trees/snapshot")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-msgpack"
+    points = decode_snapshot(response.content)
+    assert sorted((p.latitude, p.longitude) for p in points) == [(51.0, 4.0), (51.5, 4.5)]
+
+    etag = response.headers["ETag"]
+    assert client.get("/trees/snapshot", headers={"If-None-Match": etag}).status_code == 304
+    client.post(
+        "/trees", json={"name": "C", "latitude": 50.0, "longitude": 3.0}, headers=headers
+    )
+    changed = client.get("/trees/snapshot", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(decode_snapshot(changed.content)) == 3
+
+
+def test_get_tree_clusters(client):
+    """Clusters worden bijgehouden bij toevoegen, aanpassen en verwijderen."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "A", "latitude": 51.0, "longitude": 4.0},
+        {"name": "B", "latitude": 51.001, "longitude": 4.001},
+        {"name": "C", "latitude": 40.0, "longitude": -3.0},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+
+    low_zoom = client.get("/trees/clusters", params={"z": 3}).json()
+    assert sorted(c["count"] for c in low_zoom) == [1, 2]
+
+    bbox = {"min_lat": 50, "min_lon": 3, "max_lat": 52, "max_lon": 5}
+    clusters = client.get("/trees/clusters", params={"z": 3, **bbox}).json()
+    assert len(clusters) == 1
+    assert clusters[0]["count"] == 2
+    assert abs(clusters[0]["latitude"] - 51.0005) < 1e-9
+    assert clusters[0]["average_height"] is None
+
+    tree_id = client.get("/trees").json()[0]["id"]
+    client.put(f"/trees/{tree_id}", json={"height": 10, "diameter": 2}, headers=headers)
+    clusters = client.get("/trees/clusters", params={"z": 3, **bbox}).json()
+    assert clusters[0]["average_height"] == 10
+
+    client.delete(f"/trees/{tree_id}", headers=headers)
+    clusters = client.get("/trees/clusters", params={"z": 3, **bbox}).json()
+    assert clusters[0]["count"] == 1
+
+    high_zoom = client.get("/trees/clusters", params={"z": 40, **bbox}).json()
+    assert [c["count"] for c in high_zoom] == [1]
+
+
+def test_get_tree_stats(client):
+    """Statistieken volgen elke wijziging en komen overeen met een rebuild."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "A", "latitude": 51.001, "longitude": 4.001},
+        {"name": "B", "latitude": 51.002, "longitude": 4.002},
+        {"name": "C", "latitude": 51.5, "longitude": 4.5},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    ids = {tree["name"]: tree["id"] for tree in client.get("/trees").json()}
+    client.put(f"/trees/{ids['A']}", json={"height": 9, "diameter": 0.35}, headers=headers)
+    client.put(f"/trees/{ids['B']}", json={"height": 13, "diameter": 0.5}, headers=headers)
+    client.put(f"/trees/{ids['C']}", json={"height": 50}, headers=headers)
+
+    stats = client.get("/trees/stats").json()
+    assert stats["count"] == 3
+    # De wereldbox wordt niet voorbij de polen of de datumgrens verbreed
+    assert stats["bbox"] == {"min_lat": -90, "min_lon": -180, "max_lat": 90, "max_lon": 180}
+    assert stats["height"]["count"] == 3
+    assert stats["height"]["mean"] == 24
+    assert stats["diameter"]["count"] == 2
+
+    bbox = {"min_lat": 51.0, "min_lon": 4.0, "max_lat": 51.005, "max_lon": 4.005}
+    stats = client.get("/trees/stats", params={**bbox, "cells": "true"}).json()
+    assert stats["cell_degrees"] == 0.01
+    assert stats["bbox"] == {"min_lat": 51.0, "min_lon": 4.0, "max_lat": 51.01, "max_lon": 4.01}
+    assert stats["count"] == 2
+    assert stats["height"]["mean"] == 11
+    assert stats["height"]["stddev"] == pytest.approx(2)
+    assert stats["height"]["histogram"]["counts"][4] == 1  # 8 tot 10 meter
+    assert stats["height"]["histogram"]["counts"][6] == 1  # 12 tot 14 meter
+    assert stats["diameter"]["histogram"]["counts"][3:6] == [1, 0, 1]
+    assert stats["cells"] == [{"min_lat": 51.0, "min_lon": 4.0, "count": 2}]
+
+    # Een omgekeerde bbox is een fout, geen lege selectie
+    inverted = {**bbox, "min_lat": 51.005, "max_lat": 51.0}
+    assert client.get("/trees/stats", params=inverted).status_code == 422
+    inverted = {**bbox, "min_lon": 4.005, "max_lon": 4.0}
+    assert client.get("/trees/stats", params=inverted).status_code == 422
+
+    client.delete(f"/trees/{ids['B']}", headers=headers)
+    stats = client.get("/trees/stats", params=bbox).json()
+    assert (stats["count"], stats["height"]["mean"]) == (1, 9)
+    assert stats["height"]["histogram"]["counts"][6] == 0
+
+    db = TestingSessionLocal()
+    try:
+        incremental = get_stats(db, {})
+        rebuild_stats(db, iter_tree_points(db))
+        rebuilt = get_stats(db, {})
+    finally:
+        db.close()
+    assert rebuilt["count"] == incremental["count"]
+    for metric in ("height", "diameter"):
+        assert rebuilt[metric]["histogram"] == incremental[metric]["histogram"]
+        assert rebuilt[metric]["mean"] == pytest.approx(incremental[metric]["mean"])
+        assert rebuilt[metric]["stddev"] == pytest.approx(incremental[metric]["stddev"], abs=1e-6)
+
+
+def test_merge_duplicates(client, monkeypatch):
+    """Groepjes dubbele bomen uit herhaalde opmetingen samenvoegen tot een boom."""
+    headers = auth_headers(client)
+    # Zonder duplicaatcontrole bij het opladen, zoals bij oudere opmetingen
+    monkeypatch.setattr(tree_service, "DUPLICATE_RADIUS_M", 0.1)
+    metre = 1 / 111_195
+    trees = [
+        # Drie opmetingen van dezelfde boom, binnen 3 meter
+        {"name": "A1", "latitude": 51.1, "longitude": 4.1},
+        {"name": "A2", "latitude": 51.1 + 2 * metre, "longitude": 4.1},
+        {"name": "A3", "latitude": 51.1 + 3 * metre, "longitude": 4.1},
+        # Een rij bomen om de 4 meter wordt niet tot een groep aaneengeregen
+        {"name": "R1", "latitude": 51.2, "longitude": 4.2},
+        {"name": "R2", "latitude": 51.2 + 4 * metre, "longitude": 4.2},
+        {"name": "R3", "latitude": 51.2 + 8 * metre, "longitude": 4.2},
+        {"name": "Alone", "latitude": 51.3, "longitude": 4.3},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    ids = {tree["name"]: tree["id"] for tree in client.get("/trees").json()}
+    client.put(f"/trees/{ids['A2']}", json={"height": 10, "diameter": 0.4}, headers=headers)
+    client.put(f"/trees/{ids['A3']}", json={"height": 12}, headers=headers)
+    cursor = client.get("/trees").headers["X-Change-Cursor"]
+
+    db = TestingSessionLocal()
+    try:
+        # Kleine batches, zodat groepen over de grens van een batch lopen
+        report = []
+        totals = merge_duplicates(
+            db, radius_m=5, batch_size=2, dry_run=True, report=report.append
+        )
+        assert totals == {"scanned": 7, "groups": 2, "merged": 3, "dry_run": True}
+        assert len(client.get("/trees").json()) == 7
+
+        totals = merge_duplicates(db, radius_m=5, batch_size=2)
+        assert totals["merged"] == 3
+        assert merge_duplicates(db, radius_m=5, batch_size=2, dry_run=True)["merged"] == 0
+    finally:
+        db.close()
+
+    groups = sorted(report, key=lambda group: group["id"])
+    assert [group["id"] for group in groups] == [ids["A1"], ids["R1"]]
+    assert groups[0]["merged_ids"] == [ids["A2"], ids["A3"]]
+    assert groups[1]["merged_ids"] == [ids["R2"]]
+
+    remaining = {tree["name"]: tree for tree in client.get("/trees").json()}
+    assert sorted(remaining) == ["A1", "Alone", "R1", "R3"]
+    merged = remaining["A1"]
+    # Mediaan van de coordinaten en van de gekende metingen
+    assert merged["latitude"] == pytest.approx(51.1 + 2 * metre)
+    assert (merged["height"], merged["diameter"]) == (11, 0.4)
+    stats = client.get("/trees/stats").json()
+    assert (stats["count"], stats["height"]["count"]) == (4, 1)
+
+    # Samengevoegde bomen zijn updates, de rest verwijderingen
+    feed = client.get("/trees/changes", params={"since": cursor}).json()
+    assert sorted((c["op"], c["id"]) for c in feed["changes"]) == sorted(
+        [("upsert", ids["A1"]), ("upsert", ids["R1"])]
+        + [("delete", ids[name]) for name in ("A2", "A3", "R2")]
+    )
+
+
+def test_get_nearest_trees(client):
+    """De dichtstbijzijnde bomen opvragen."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "Far", "latitude": 51.01, "longitude": 4.0},
+        {"name": "Near", "latitude": 51.0002, "longitude": 4.0},
+        {"name": "Middle", "latitude": 51.002, "longitude": 4.0},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    ids = {t["name"]: t["id"] for t in client.get("/trees").json()}
+
+    nearest = client.get("/trees/nearest", params={"lat": 51.0, "lon": 4.0, "k": 2}).json()
+    assert [t["id"] for t in nearest] == [ids["Near"], ids["Middle"]]
+    assert abs(nearest[0]["distance_m"] - 22.24) < 0.1
+
+    limited = client.get(
+        "/trees/nearest", params={"lat": 51.0, "lon": 4.0, "max_distance_m": 100}
+    ).json()
+    assert [t["id"] for t in limited] == [ids["Near"]]
+
+    # De index volgt toevoegingen en verwijderingen
+    client.delete(f"/trees/{ids['Near']}", headers=headers)
+    created = client.post(
+        "/trees", json={"name": "New", "latitude": 51.0, "longitude": 4.0001}, headers=headers
+    ).json()
+    nearest = client.get("/trees/nearest", params={"lat": 51.0, "lon": 4.0, "k": 1}).json()
+    assert [t["id"] for t in nearest] == [created["id"]]
+
+
+def test_get_trees_within_polygon(client):
+    """Bomen binnen een (multi)polygoon, met gaten, tellen en ophalen."""
+    headers = auth_headers(client)
+    trees = [
+        {"name": "Park", "latitude": 51.21, "longitude": 4.41},
+        {"name": "Vijver", "latitude": 51.25, "longitude": 4.45},
+        {"name": "Buiten", "latitude": 51.29, "longitude": 4.49},
+        {"name": "Ver", "latitude": 50.0, "longitude": 3.0},
+    ]
+    client.post("/trees/bulk", json=trees, headers=headers)
+    ids = {tree["name"]: tree["id"] for tree in client.get("/trees").json()}
+
+    # Een vierkant met een gat rond de vijver, coordinaten als [lat, lon]
+    outer = [[51.2, 4.4], [51.28, 4.4], [51.28, 4.48], [51.2, 4.48], [51.2, 4.4]]
+    hole = [[51.24, 4.44], [51.26, 4.44], [51.26, 4.46], [51.24, 4.46], [51.24, 4.44]]
+    polygon = {"type": "Polygon", "coordinates": [outer, hole]}
+    response = client.post("/trees/within", json=polygon)
+    assert response.status_code == 200
+    assert response.json() == {"count": 1, "ids": [ids["Park"]]}
+
+    square = [[49.9, 2.9], [50.1, 2.9], [50.1, 3.1], [49.9, 3.1]]
+    multi = {
+        "type": "Feature",
+        "geometry": {"type": "MultiPolygon", "coordinates": [[outer], [square]]},
+    }
+    response = client.post("/trees/within", params={"output": "count"}, json=multi)
+    assert response.json() == {"count": 3}
+
+    response = client.post("/trees/within", params={"output": "features"}, json=multi)
+    assert response.headers["content-type"].startswith("application/geo+json")
+    features = response.json()["features"]
+    assert [f["properties"]["name"] for f in features] == ["Park", "Vijver", "Ver"]
+    assert features[0]["geometry"]["coordinates"] == [51.21, 4.41]
+
+    point = {"type": "Point", "coordinates": [51.2, 4.4]}
+    assert client.post("/trees/within", json=point).status_code == 422
+    broken = {"type": "Polygon", "coordinates": [[[51.2, 4.4], [51.3, "x"]]]}
+    assert client.post("/trees/within", json=broken).status_code == 422
+
+
+def test_revoked_token_synced_from_database(client):
+    """Een token ingetrokken door een andere worker wordt opgepikt bij het synchroniseren."""
+    client.post("/register", json={"username": "testuser", "password": "testpassword"})
+    token = client.post(
+        "/login", data={"username": "testuser", "password": "testpassword"}
+    ).json()["data"]["access_token"]
+    assert client.get(f"/verify-token/{token}").status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        db.add(RevokedToken(token_hash=token_digest(token)))
+        db.commit()
+        # Zonder synchronisatie weet deze worker het nog niet
+        assert client.get(f"/verify-token/{token}").status_code == 200
+        load_revocations(db)
+    finally:
+        db.close()
+    response = client.get(f"/verify-token/{token}")
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Token has been revoked."}
+
+
+def test_purge_expired_revocations(client):
+    """Verlopen ingetrokken tokens worden in batches opgeruimd."""
+    client.post("/register", json={"username": "testuser", "password": "testpassword"})
+    token = client.post(
+        "/login", data={"username": "testuser", "password": "testpassword"}
+    ).json()["data"]["access_token"]
+    client.post(f"/revoke-token/{token}")
+
+    db = TestingSessionLocal()
+    try:
+        stored = db.query(RevokedToken).one()
+        assert stored.token_hash == token_digest(token)
+        assert stored.expires_at > datetime.utcnow()
+
+        past = datetime.utcnow() - timedelta(hours=1)
+        db.add_all(
+            RevokedToken(token_hash=token_digest(f"old-{i}"), expires_at=past)
+            for i in range(5)
+        )
+        db.commit()
+        assert purge_expired_revocations(db, batch_size=2) == 5
+        assert [r.token_hash for r in db.query(RevokedToken)] == [token_digest(token)]
+    finally:
+        db.close()
+
+
+def test_revoke_invalid_token(client):
+    response = client.post("/revoke-token/invalidtoken123")
+    assert response.status_code == 401
+
+
+def test_token_cache(client):
+    """Herhaalde tokens worden uit de cache gehaald tot ze ingetrokken worden."""
+    clear_token_cache()
+    client.post("/register", json={"username": "testuser", "password": "testpassword"})
+    token = client.post(
+        "/login", data={"username": "testuser", "password": "testpassword"}
+    ).json()["data"]["access_token"]
+
+    for _ in range(3):
+        assert client.get(f"/verify-token/{token}").status_code == 200
+    stats = client.get("/internal/token-cache").json()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 1)
+
+    client.post(f"/revoke-token/{token}")
+    assert client.get("/internal/token-cache").json()["size"] == 0
+    assert client.get(f"/verify-token/{token}").status_code == 401
+
+
+def test_pool_stats(client):
+    stats = client.get("/internal/pool").json()
+    assert "checked_out" in stats["sync"]
+
+
+def test_metrics(client):
+    """Latency en queries per route-template, zonder tokens in de output."""
+    token = auth_headers(client)["Authorization"].split()[1]
+    client.get("/trees")
+    client.get(f"/verify-token/{token}")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/trees",status="200"}' in body
+    assert 'route="/verify-token/{token}"' in body
+    # Tokens mogen nooit in de metrics terechtkomen.
+    assert token not in body
+    queries = next(
+        line for line in body.splitlines()
+        if line.startswith('http_request_db_queries_total{method="GET",route="/trees"}')
+    )
+    assert int(queries.split()[-1]) >= 1
+
+
+def test_tree_changes_feed(client):
+    """De wijzigingsfeed geeft toevoegingen, updates en verwijderingen in volgorde."""
+    headers = auth_headers(client)
+    listing = client.get("/trees")
+    cursor = listing.headers["X-Change-Cursor"]
+
+    first = client.post(
+        "/trees", json={"name": "A", "latitude": 50.0, "longitude": 4.0}, headers=headers
+    ).json()
+    second = client.post(
+        "/trees", json={"name": "B", "latitude": 50.1, "longitude": 4.0}, headers=headers
+    ).json()
+    client.put(f"/trees/{first['id']}", json={"height": 12.5, "diameter": 0.4}, headers=headers)
+    client.delete(f"/trees/{second['id']}", headers=headers)
+
+    feed = client.get("/trees/changes", params={"since": cursor}).json()
+    assert [(c["op"], c["id"]) for c in feed["changes"]] == [
+        ("upsert", first["id"]),
+        ("delete", second["id"]),
+    ]
+    assert feed["changes"][0]["tree"]["height"] == 12.5
+    assert feed["has_more"] is False
+
+    # Pagineren met een kleine limiet levert dezelfde wijzigingen op
+    page = client.get("/trees/changes", params={"since": cursor, "limit": 1}).json()
+    assert page["has_more"] is True
+    rest = client.get("/trees/changes", params={"since": page["cursor"]}).json()
+    assert page["changes"] + rest["changes"] == feed["changes"]
+
+    empty = client.get("/trees/changes", params={"since": feed["cursor"]}).json()
+    assert empty["changes"] == []
+    assert empty["cursor"] == feed["cursor"]
+
+    assert client.get("/trees/changes", params={"since": "%%%"}).status_code == 400
+
+
+def test_new_trees_stamped_in_insert(client):
+    """Nieuwe bomen krijgen hun change_seq in de INSERT, zonder extra UPDATE."""
+    headers = auth_headers(client)
+    cursor = client.get("/trees").headers["X-Change-Cursor"]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        single = client.post(
+            "/trees", json={"name": "A", "latitude": 50.0, "longitude": 4.0}, headers=headers
+        ).json()
+        client.post(
+            "/trees/bulk",
+            json=[{"name": "B", "latitude": 50.1, "longitude": 4.0}],
+            headers=headers,
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert not [s for s in statements if s.startswith("UPDATE trees")]
+
+    feed = client.get("/trees/changes", params={"since": cursor}).json()
+    assert [c["tree"]["name"] for c in feed["changes"]] == ["A", "B"]
+
+    db = TestingSessionLocal()
+    try:
+        trees = db.query(Tree).order_by(Tree.id).all()
+        assert trees[0].id == single["id"]
+        assert [tree.updated_at for tree in trees] == [tree.added_at for tree in trees]
+        assert trees[0].change_seq < trees[1].change_seq
+    finally:
+        db.close()
+
+
+def test_tree_events_stream(client):
+    """Wijzigingen binnen de bbox worden als Server-Sent Events gepusht."""
+    headers = auth_headers(client)
+
+    async def scenario():
+        response = await get_tree_events(min_lat=50.5, max_lat=51.5, min_lon=3.5, max_lon=4.5)
+        assert response.media_type == "text/event-stream"
+        events = response.body_iterator
+        assert await anext(events) == "retry: 5000\n\n"
+        # De requests lopen in een andere thread, zoals een API-worker
+        await asyncio.to_thread(
+            client.post,
+            "/trees",
+            json={"name": "Far", "latitude": 40.0, "longitude": -3.0},
+            headers=headers,
+        )
+        created = await asyncio.to_thread(
+            client.post,
+            "/trees",
+            json={"name": "Near", "latitude": 51.0, "longitude": 4.0},
+            headers=headers,
+        )
+        message = await asyncio.wait_for(anext(events), 5)
+        await events.aclose()
+        return created.json(), message
+
+    created, message = asyncio.run(scenario())
+    lines = message.strip().split("\n")
+    assert lines[1] == "event: trees"
+    event = json.loads(lines[2][len("data: "):])
+    assert [(c["op"], c["id"]) for c in event["changes"]] == [("upsert", created["id"])]
+    assert get_hub()._subscriptions == set()
+    feed = client.get("/trees/changes", params={"since": event["cursor"]}).json()
+    assert feed["changes"] == []
@@ -1,9 +1,16 @@
+import hashlib
+import os
 import pytest
-from sqlalchemy import create_engine
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from database import Base, get_db
 from models.user_model import User
 from models.tree_model import Tree
+from services.spatial_service import grid_cell
 from datetime import datetime
 
 
@@ -113,4 +120,34 @@ def test_delete_tree(db):
     db.commit()
 
     remaining_trees = db.query(Tree).all()
-    assert len(remaining_trees) == 0
\ No newline at end of file
+    assert len(remaining_trees) == 0
+
+
+def _migrate(connection, revision):
+    config = Config(os.path.join(os.path.dirname(__file__), "alembic.ini"))
+    config.attributes["connection"] = connection
+    command.upgrade(config, revision)
+
+
+def test_migrations_match_models(tmp_path):
+    """De migraties leveren exact het schema van de modellen op."""
+    migration_engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    with migration_engine.begin() as connection:
+        _migrate(connection, "0001")
+        # Een oud ingetrokken token wordt omgezet naar zijn digest
+        connection.execute(text("INSERT INTO revoked_tokens (token) VALUES ('a.b.c')"))
+        # Een bestaande boom krijgt zijn gridcel, anders is hij onzichtbaar voor
+        # de duplicaatcontrole
+        connection.execute(text(
+            "INSERT INTO trees (name, latitude, longitude) VALUES ('Oak', 51.1234, 4.5678)"
+        ))
+        _migrate(connection, "head")
+
+        cell = connection.execute(text("SELECT grid_cell FROM trees")).scalar()
+        assert cell == grid_cell(51.1234, 4.5678)
+
+        token_hash = connection.execute(text("SELECT token_hash FROM revoked_tokens")).scalar()
+        assert token_hash == hashlib.sha256(b"a.b.c").hexdigest()
+        context = MigrationContext.configure(connection)
+        assert compare_metadata(context, Base.metadata) == []
+    migration_engine.dispose()
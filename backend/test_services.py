@@ -0,0 +1,393 @@
+import asyncio
+import json
+import math
+import msgpack
+import random
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from unittest.mock import patch
+from database import TimedQueuePool, pool_stats
+from metrics import Histogram
+import profiling
+from profiling import QueryProfilerMiddleware, parameter_shape, profile_engine, statement_template
+from services import cache_service, nearest_service
+from services.nearest_service import apply_nearest_changes, nearest_trees, reset_nearest_index
+from services import event_service
+from services.event_service import TreeEventHub, tree_changes_event
+from services.polygon_service import parse_polygons, points_in_polygons, polygons_bbox
+from services.snapshot_service import decode_snapshot, encode_snapshot
+from services.cache_service import bump_tree_version, clear_tree_cache, get_or_load
+from services.spatial_service import (
+    TreePoint,
+    grid_cell,
+    haversine_m,
+    neighbour_cells,
+    split_cell_key,
+)
+
+
+def test_haversine_m():
+    # Een breedtegraad is ongeveer 111 km
+    assert abs(haversine_m(51.0, 4.0, 52.0, 4.0) - 111_195) < 10
+    assert haversine_m(51.0, 4.0, 51.0, 4.0) == 0
+
+
+def test_grid_cell_roundtrip():
+    row, col = split_cell_key(grid_cell(51.1234, 4.5678))
+    assert row > 0 and col > 0
+    assert grid_cell(51.1234, 4.5678) == grid_cell(51.1234, 4.5678)
+
+
+def test_neighbour_cells_cover_radius():
+    """Elk punt binnen de straal ligt in een van de buurcellen."""
+    lat, lon = 51.1234, 4.5678
+    cells = set(neighbour_cells(lat, lon, 10))
+    for d_lat in (-0.00009, 0, 0.00009):
+        for d_lon in (-0.00014, 0, 0.00014):
+            other = (lat + d_lat, lon + d_lon)
+            if haversine_m(lat, lon, *other) <= 10:
+                assert grid_cell(*other) in cells
+
+
+def test_neighbour_cells_grow_with_radius():
+    assert len(neighbour_cells(51.0, 4.0, 10)) == 9
+    assert len(neighbour_cells(51.0, 4.0, 25)) == 49
+
+
+def test_get_or_load_single_flight():
+    """Gelijktijdige cache misses voeren de loader maar een keer uit."""
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def scenario():
+        clear_tree_cache()
+        results = await asyncio.gather(
+            *(get_or_load("single-flight", loader) for _ in range(8))
+        )
+        assert results == ["value"] * 8
+        assert len(calls) == 1
+
+        async def new_loader():
+            return "new"
+
+        bump_tree_version()
+        assert await get_or_load("single-flight", new_loader) == "new"
+
+    asyncio.run(scenario())
+
+
+def test_get_or_load_revalidates_expired_entries(monkeypatch):
+    """Een verlopen entry blijft zolang de stempel niet verandert."""
+    monkeypatch.setattr(cache_service, "CACHE_TTL_SECONDS", 0)
+    calls = []
+    seq = [1]
+
+    async def loader():
+        calls.append(1)
+        return len(calls)
+
+    async def stamp():
+        return seq[0]
+
+    async def scenario():
+        clear_tree_cache()
+        assert await get_or_load("revalidate", loader, stamp) == 1
+        assert await get_or_load("revalidate", loader, stamp) == 1
+        # Een andere worker heeft een boom gewijzigd
+        seq[0] = 2
+        assert await get_or_load("revalidate", loader, stamp) == 2
+        assert await get_or_load("revalidate", loader, stamp) == 2
+        # Zonder stempel wordt een verlopen entry altijd opnieuw geladen
+        assert await get_or_load("revalidate", loader) == 3
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
+
+
+def test_nearest_trees_matches_brute_force():
+    """De grid-zoektocht geeft dezelfde bomen als alles overlopen."""
+    random.seed(7)
+    points = [
+        TreePoint(i, 51 + random.uniform(-0.05, 0.05), 4 + random.uniform(-0.05, 0.05))
+        for i in range(1, 2001)
+    ]
+    reset_nearest_index()
+    with patch("services.nearest_service._build") as build:
+        build.return_value = nearest_service._GridIndex()
+        nearest_service._ensure_loaded(None)
+    apply_nearest_changes(added=points)
+
+    for lat, lon in [(51.0, 4.0), (51.04, 3.96), (51.1, 4.1)]:
+        found = [p.id for _, p in nearest_trees(None, lat, lon, 5)]
+        expected = sorted(points, key=lambda p: haversine_m(lat, lon, p.latitude, p.longitude))
+        assert found == [p.id for p in expected[:5]]
+    # Verder dan de maximale afstand wordt niet gezocht
+    assert nearest_trees(None, 51.3, 4.3, 5) == []
+    reset_nearest_index()
+
+
+def test_nearest_trees_sparse_area_uses_blocks():
+    """Ver uit elkaar liggende bomen worden via de blokken gevonden, met weinig ringen."""
+    random.seed(3)
+    points = [
+        TreePoint(i, 51 + random.uniform(-0.08, 0.08), 4 + random.uniform(-0.12, 0.12))
+        for i in range(1, 41)
+    ]
+    reset_nearest_index()
+    with patch("services.nearest_service._build") as build:
+        build.return_value = nearest_service._GridIndex()
+        nearest_service._ensure_loaded(None)
+    apply_nearest_changes(added=points)
+
+    for lat, lon in [(51.0, 4.0), (51.07, 3.9), (51.1, 4.2)]:
+        found = [p.id for _, p in nearest_trees(None, lat, lon, 3)]
+        expected = sorted(points, key=lambda p: haversine_m(lat, lon, p.latitude, p.longitude))
+        expected = [
+            p for p in expected
+            if haversine_m(lat, lon, p.latitude, p.longitude) <= nearest_service.NEAREST_MAX_DISTANCE_M
+        ]
+        assert found == [p.id for p in expected[:3]]
+
+    # Een lege omgeving kost tientallen ringen in plaats van honderden
+    with patch("services.nearest_service._ring", wraps=nearest_service._ring) as ring:
+        assert nearest_trees(None, 52.0, 5.0, 3) == []
+    assert ring.call_count < 50
+    reset_nearest_index()
+
+
+def test_nearest_first_load_waits_for_build():
+    """Gelijktijdige eerste requests wachten op dezelfde lading van de index."""
+    reset_nearest_index()
+    started = threading.Event()
+
+    def build(db):
+        started.set()
+        time.sleep(0.2)
+        index = nearest_service._GridIndex()
+        index.add(TreePoint(1, 51.0, 4.0))
+        return index
+
+    results = []
+    errors = []
+
+    def search():
+        try:
+            results.append([p.id for _, p in nearest_trees(None, 51.0, 4.0, 1)])
+        except Exception as exc:
+            errors.append(exc)
+
+    with patch("services.nearest_service._build", side_effect=build) as patched:
+        first = threading.Thread(target=search)
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=search)
+        second.start()
+        first.join(5)
+        second.join(5)
+    assert errors == []
+    assert results == [[1], [1]]
+    assert patched.call_count == 1
+    reset_nearest_index()
+
+
+def test_nearest_reload_keeps_changes_made_during_build():
+    """Wijzigingen tijdens het herladen gaan niet verloren."""
+    old = TreePoint(1, 51.0, 4.0)
+    new = TreePoint(2, 51.0001, 4.0)
+    reset_nearest_index()
+
+    def build(db):
+        # De tabel is gelezen voor een andere request de boom vervangt
+        index = nearest_service._GridIndex()
+        index.add(old)
+        apply_nearest_changes(added=[new], removed=[old])
+        return index
+
+    with patch("services.nearest_service._build", side_effect=build):
+        nearest_service.load_nearest_index(None)
+    assert [p.id for _, p in nearest_trees(None, 51.0, 4.0, 5)] == [2]
+    reset_nearest_index()
+
+
+def test_timed_pool_records_waits_and_timeouts():
+    """De pool houdt wachttijden en timeouts bij."""
+    engine = create_engine(
+        "sqlite:///testing.db",
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    before = TimedQueuePool.wait_seconds.snapshot()["count"]
+    timeouts = TimedQueuePool.timeouts
+    with engine.connect():
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    stats = pool_stats(engine)
+    assert stats["timeouts"] == timeouts + 1
+    assert stats["wait_seconds"]["count"] == before + 2
+    assert stats["checked_out"] == 0
+    engine.dispose()
+
+
+def test_histogram_snapshot():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == [(0.1, 1), (1.0, 3), (float("inf"), 4)]
+    assert snapshot["count"] == 4
+    assert snapshot["sum"] == 4.05
+
+
+def test_statement_template_collapses_in_lists():
+    assert statement_template("SELECT * FROM trees\n WHERE id IN (?, ?, ?)") == (
+        "SELECT * FROM trees WHERE id IN (?, ...)"
+    )
+    assert statement_template("WHERE id IN (%s, %s)") == "WHERE id IN (%s, ...)"
+
+
+def test_parameter_shape_hides_values():
+    assert parameter_shape({"token_hash": "geheim"}) == {"token_hash": "str"}
+    assert parameter_shape([("a", 1.0), ("b", 2.0)], executemany=True) == {
+        "rows": 2,
+        "row": ["str", "float"],
+    }
+
+
+def test_query_profiler_flags_repeated_statements(caplog, monkeypatch):
+    """Een request die dezelfde query te vaak uitvoert, wordt gelogd."""
+    monkeypatch.setattr(profiling, "REPEAT_LIMIT", 3)
+    monkeypatch.setattr(profiling, "SLOW_QUERY_MS", 10_000)
+    engine = create_engine("sqlite://")
+    profile_engine(engine)
+
+    async def app(scope, receive, send):
+        with engine.connect() as conn:
+            for i in range(5):
+                conn.execute(text("SELECT :i"), {"i": i})
+            conn.execute(text("SELECT 1"))
+
+    scope = {"type": "http", "method": "GET"}
+    with caplog.at_level("INFO", logger="query_profile"):
+        asyncio.run(QueryProfilerMiddleware(app)(scope, None, None))
+    records = [json.loads(r.getMessage()) for r in caplog.records if r.name == "query_profile"]
+    assert len(records) == 1
+    assert records[0]["event"] == "repeated_query"
+    assert records[0]["template"] == "SELECT ?"
+    assert records[0]["count"] == 5
+
+
+def test_snapshot_round_trip():
+    """Een snapshot decodeert naar dezelfde bomen, op een micrograad na."""
+    rng = random.Random(3)
+    points = [
+        TreePoint(
+            rng.randrange(1, 10**7),
+            rng.uniform(-60, 70),
+            rng.uniform(-180, 180),
+            rng.choice([None, round(rng.uniform(1, 40), 2)]),
+            rng.choice([None, round(rng.uniform(0.05, 3), 3)]),
+        )
+        for _ in range(2000)
+    ]
+    decoded = decode_snapshot(encode_snapshot(points))
+
+    assert len(decoded) == len(points)
+    by_id = {point.id: point for point in points}
+    for point in decoded:
+        original = by_id[point.id]
+        assert abs(point.latitude - original.latitude) <= 0.5e-6
+        assert abs(point.longitude - original.longitude) <= 0.5e-6
+        assert point.height == original.height
+        assert point.diameter == original.diameter
+
+
+def test_snapshot_empty_and_wrong_format():
+    assert decode_snapshot(encode_snapshot([])) == []
+    with pytest.raises(ValueError):
+        decode_snapshot(msgpack.packb({"format": 99}))
+
+
+def test_event_hub_filters_by_bbox():
+    """Abonnees krijgen enkel wijzigingen binnen hun bbox, ook vanuit een thread."""
+    hub = TreeEventHub()
+    inside = TreePoint(1, 51.0, 4.0)
+    outside = TreePoint(2, 40.0, -3.0)
+
+    async def scenario():
+        everything = hub.subscribe()
+        antwerp = hub.subscribe({"min_lat": 50.5, "max_lat": 51.5, "min_lon": 3.5, "max_lon": 4.5})
+        publisher = threading.Thread(
+            target=hub.publish, args=(tree_changes_event(7, [inside, outside], []),)
+        )
+        publisher.start()
+        publisher.join()
+        hub.publish(tree_changes_event(8, [], [outside]))
+        first = await asyncio.wait_for(antwerp.get(), 1)
+        all_events = [await asyncio.wait_for(everything.get(), 1) for _ in range(2)]
+        return first, all_events, antwerp.queue.empty()
+
+    first, all_events, antwerp_done = asyncio.run(scenario())
+    assert first == {
+        "seq": 7,
+        "changes": [
+            {"op": "upsert", "id": 1, "lat": 51.0, "lon": 4.0, "height": None, "diameter": None}
+        ],
+    }
+    assert [len(event["changes"]) for event in all_events] == [2, 1]
+    assert all_events[1]["changes"][0]["op"] == "delete"
+    assert antwerp_done
+
+
+def test_event_hub_drops_slow_subscribers(monkeypatch):
+    monkeypatch.setattr(event_service, "SUBSCRIBER_QUEUE_SIZE", 2)
+    hub = TreeEventHub()
+
+    async def scenario():
+        slow = hub.subscribe()
+        for seq in range(3):
+            hub.publish(tree_changes_event(seq, [TreePoint(seq, 1.0, 1.0)]))
+        await asyncio.sleep(0)
+        overflowed = await slow.get()
+        hub.publish(tree_changes_event(4, [TreePoint(4, 1.0, 1.0)]))
+        return overflowed, hub._subscriptions
+
+    overflowed, subscriptions = asyncio.run(scenario())
+    assert overflowed is None
+    assert subscriptions == set()
+
+
+def _ray_cast(lat, lon, ring):
+    inside = False
+    for (lat0, lon0), (lat1, lon1) in zip(ring, ring[1:] + ring[:1]):
+        if (lat0 > lat) != (lat1 > lat) and lon < lon0 + (lat - lat0) * (lon1 - lon0) / (lat1 - lat0):
+            inside = not inside
+    return inside
+
+
+def test_points_in_polygons_matches_ray_casting():
+    """De gevectoriseerde test geeft hetzelfde als punt per punt, ook met een gat."""
+    random.seed(3)
+    star = [
+        [51 + (0.1 if i % 2 else 0.04) * math.sin(i * math.pi / 8),
+         4 + (0.1 if i % 2 else 0.04) * math.cos(i * math.pi / 8)]
+        for i in range(16)
+    ]
+    hole = [[50.99, 3.99], [51.01, 3.99], [51.01, 4.01], [50.99, 4.01]]
+    polygons = parse_polygons({"type": "Polygon", "coordinates": [star, hole]})
+    points = [(random.uniform(50.85, 51.15), random.uniform(3.85, 4.15)) for _ in range(5000)]
+
+    mask = points_in_polygons([p[0] for p in points], [p[1] for p in points], polygons)
+    expected = [_ray_cast(lat, lon, star) != _ray_cast(lat, lon, hole) for lat, lon in points]
+    assert mask.tolist() == expected
+    assert 0 < sum(expected) < len(points)
+    lats, lons = [p[0] for p in star], [p[1] for p in star]
+    assert polygons_bbox(polygons) == (min(lats), min(lons), max(lats), max(lons))